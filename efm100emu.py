@@ -46,8 +46,10 @@
 
 
 from datetime import *
+from emucommon import *
 import os
 import random
+import signal
 import sys
 import threading
 import time
@@ -65,12 +67,28 @@ efmunit = None
 #############
 DEBUG_MODE = False
 
+EFM100_BATCH_INTERVAL = 0.01
 EFM100_BITS = 8
+EFM100_CATCHUP = CATCHUP_SKIP
+EFM100_CLOCK_SPEED = 1.
+EFM100_FLUSH_POLICY = FLUSH_BATCH
+EFM100_LINE_PACING = False
 EFM100_PARITY = "N"
 EFM100_PORT = "/dev/ttyu0"
+EFM100_RATE = 10.
+EFM100_RATE_MAX = 1000.
+EFM100_RATE_MIN = 1.
+EFM100_RECORD_COMPRESS = True
+EFM100_RECORD_FILE = ""
+EFM100_REPLAY_FILE = ""
+EFM100_REPLAY_SPEED = 1.
+EFM100_REPLAY_START = 0.
+EFM100_RUN_FOR = 0.
 EFM100_SQUELCH = 0
 EFM100_SPEED = 9600
 EFM100_STOPBITS = 1
+EFM100_TCP_BUFFER = TCP_BUFFER
+EFM100_TCP_OVERFLOW = TCP_OVERFLOW_DROP
 
 XML_SETTINGS_FILE = "efm100emu-settings.xml"
 
@@ -80,9 +98,23 @@ XML_SETTINGS_FILE = "efm100emu-settings.xml"
 ###########
 class EFM100Emu():
 	# $<p><ee.ee>,<f>*<cs><cr><lf>
-	def __init__(self, port, speed, bits, parity, stopbits, debug_mode = False):
+	
+	# The field level is clamped to +/-20.00KV and the fault is on or off so
+	# there are only ~8,000 possible sentences, these are built once and
+	# shared between all the units in the process keyed on (centivolts, fault).
+	sentence_cache = {}
+	
+	def __init__(self, port, speed, bits, parity, stopbits, debug_mode = False, flush_policy = FLUSH_BATCH, tcp_buffer = TCP_BUFFER, tcp_overflow = TCP_OVERFLOW_DROP, autostart = True, clock = None, catchup = CATCHUP_SKIP, rate = 10., pacing = False):
 		self.efl = 0.
 		self.fault = False
+		self.field = None
+		self.lock = threading.Lock()
+		self.clock = clock or RealClock()
+		self.next_status = 0.
+		self.output = None
+		self.pacer = None
+		self.replay = None
+		self.schedule = None
 		self.serial = None
 		self.txthread = None
 		self.txthread_alive = False
@@ -95,17 +127,63 @@ class EFM100Emu():
 		# Setup everything we need
 		self.log("__init__", "Information", "Initialising EFM-100 emulator...")
 		
-		self.setupUnit(port, speed, bits, parity, stopbits)
-		self.start()
+		# Build every sentence now (only the first unit in the process pays for it) so the transmit path never has to
+		self.precacheSentences()
+		
+		self.setupUnit(port, speed, bits, parity, stopbits, flush_policy, tcp_buffer, tcp_overflow)
+		
+		if pacing:
+			self.pacer = LinePacer(speed, bits, parity, stopbits)
+			
+			# Sentences handed over to the output share the line
+			self.output.pacer = self.pacer
+		
+		# The sentence goes out rate times a second on an absolute grid, see StatusSchedule
+		rate = self.checkRate(rate)
+		
+		self.schedule = StatusSchedule(1. / rate, self.clock.monotonic() + 1. / rate, catchup, batch = self.rateBatch(rate))
+		self.next_status = self.schedule.deadline()
+		
+		if autostart:
+			self.start()
 	
 	def adjustElectricFieldLevel(self, amount):
-		self.efl += float(amount)
+		with self.lock:
+			self.efl = min(max(self.efl + float(amount), -20.), 20.)
+			
+			return self.efl
+	
+	def buildSentence(self, centivolts, fault):
+		s = bytearray()
 		
-		if self.efl > 20.:
-			self.efl = 20.
+		if centivolts >= 0:
+			s.extend(self.EFM_POSITIVE) # <p>
+			s.extend("%2.2f" % (centivolts / 100.)) # <ee.ee>
 			
-		elif self.efl < -20.:
-			self.efl = -20.
+		else:
+			s.extend(self.EFM_NEGATIVE) # <p>
+			s.extend("%2.2f" % (-centivolts / 100.)) # <ee.ee>
+		
+		s.extend(",")
+		
+		s.extend("%d" % int(fault)) # <f>
+		
+		s.extend("*")
+		
+		c = self.checksum(str(s))
+		s.extend(c) # <cs>
+		
+		s.extend("\r\n")
+		
+		return str(s)
+	
+	def checkRate(self, rate):
+		rate = float(rate)
+		
+		if rate < EFM100_RATE_MIN or rate > EFM100_RATE_MAX:
+			raise ValueError("The rate must be between %.0fHz and %.0fHz." % (EFM100_RATE_MIN, EFM100_RATE_MAX))
+		
+		return rate
 	
 	def checksum(self, data):
 		s = 0
@@ -134,32 +212,163 @@ class EFM100Emu():
 		
 		self.txthread_alive = False
 		
+		if self.output is not None:
+			self.output.waker.wake()
+		
+		if self.txthread is not None:
+			self.txthread.join(1.)
+		
+		if self.output is not None:
+			self.output.close()
+		
 		if self.serial is not None:
 			self.serial.close()
 			self.serial = None
 	
+	def getSentence(self):
+		with self.lock:
+			key = (int(round(self.efl * 100.)), bool(self.fault))
+		
+		try:
+			return self.sentence_cache[key]
+			
+		except KeyError:
+			s = self.buildSentence(key[0], key[1])
+			
+			self.sentence_cache[key] = s
+			
+			return s
+	
 	def log(self, module, level, message):
 		print "EFM100EMU/%s()/%s - %s" % (module, level, message)
 	
-	def setupUnit(self, port, speed, bits, parity, stopbits):
+	def precacheSentences(self):
 		if self.DEBUG_MODE:
-			self.log("setupUnit", "Information", "Running...")
+			self.log("precacheSentences", "Information", "Running...")
+		
+		
+		for centivolts in range(-2000, 2001):
+			for fault in [False, True]:
+				key = (centivolts, fault)
+				
+				if key not in self.sentence_cache:
+					self.sentence_cache[key] = self.buildSentence(centivolts, fault)
+	
+	def rateBatch(self, rate):
+		# Above 1 / EFM100_BATCH_INTERVAL Hz several sentences go out per wakeup
+		return max(1, int(float(rate) * EFM100_BATCH_INTERVAL))
+	
+	def service(self, now):
+		# Sends the sentence(s) if due, returns when it next needs to be called
+		self.output.clearWake()
 		
+		with self.lock:
+			count = self.schedule.due(now)
+		
+		if count > 0:
+			# Our own sentence is replaced by the capture when replaying
+			if self.replay is None:
+				if self.field is not None:
+					self.setElectricFieldLevel(self.field.level(now))
+				
+				sentence = self.getSentence()
+				
+				if self.pacer is not None:
+					# A sentence the line has no room for is lost, just like a mill sampling faster than its link
+					sent = self.pacer.take([len(sentence)] * count, now)
+					
+					self.pacer.dropped += count - sent
+					count = sent
+				
+				if count == 1:
+					self.output.write(sentence)
+					
+				elif count > 1:
+					self.output.writeBatch([sentence] * count)
+				
+				if count > 0:
+					self.schedule.sent(self.clock.monotonic(), count)
+			
+			
+			with self.lock:
+				self.next_status = self.schedule.deadline()
 		
-		import serial
+		# Anything handed over (a capture being replayed) goes out even when nothing of ours is due
+		self.output.writeBatch([])
 		
+		ready = self.output.readyAt()
 		
-		self.serial = serial.Serial()
-		self.serial.baudrate = speed
-		self.serial.bytesize = bits
-		self.serial.parity = parity
-		self.serial.port = port
-		self.serial.stopbits = stopbits
-		self.serial.timeout = 10.
-		self.serial.writeTimeout = None
-		self.serial.xonxoff = False
+		if ready is not None:
+			# Handed over sentences held back for the line
+			return min(self.next_status, ready)
 		
-		self.serial.open()
+		return self.next_status
+	
+	def setElectricFieldLevel(self, level):
+		with self.lock:
+			self.efl = min(max(float(level), -20.), 20.)
+			
+			return self.efl
+	
+	def setFault(self, active):
+		with self.lock:
+			self.fault = bool(active)
+	
+	def setFieldModel(self, field):
+		# The field level comes from a FieldModel from now on, None to go back to setting it by hand
+		self.field = field
+	
+	def setRate(self, rate):
+		# Takes effect from the next sentence
+		rate = self.checkRate(rate)
+		
+		with self.lock:
+			self.schedule.setPeriod(1. / rate, self.rateBatch(rate))
+			
+			return rate
+	
+	def setupUnit(self, port, speed, bits, parity, stopbits, flush_policy = FLUSH_BATCH, tcp_buffer = TCP_BUFFER, tcp_overflow = TCP_OVERFLOW_DROP):
+		if self.DEBUG_MODE:
+			self.log("setupUnit", "Information", "Running...")
+		
+		
+		if port == PTY_PREFIX or port.startswith(PTY_PREFIX + ":"):
+			link = port[len(PTY_PREFIX) + 1:]
+			
+			self.serial = PTYPort(iif(link == "", None, link), speed, 10.)
+			self.serial.open()
+			
+			self.log("setupUnit", "Information", "Emulating on pseudo-terminal %s." % iif(link == "", self.serial.name, "%s (%s)" % (link, self.serial.name)))
+			
+		elif port.startswith(FILE_PREFIX + ":"):
+			self.serial = FilePort(port[len(FILE_PREFIX) + 1:], 10.)
+			self.serial.open()
+			
+			self.log("setupUnit", "Information", "Emulating into file %s." % self.serial.name)
+			
+		elif port.startswith(TCP_PREFIX + ":"):
+			self.serial = TCPPort(port[len(TCP_PREFIX) + 1:], tcp_buffer, tcp_overflow, 10.)
+			self.serial.open()
+			
+			self.log("setupUnit", "Information", "Emulating on %s." % self.serial.name)
+			
+		else:
+			import serial
+			
+			
+			self.serial = serial.Serial()
+			self.serial.baudrate = speed
+			self.serial.bytesize = bits
+			self.serial.parity = parity
+			self.serial.port = port
+			self.serial.stopbits = stopbits
+			self.serial.timeout = 10.
+			self.serial.writeTimeout = None
+			self.serial.xonxoff = False
+			
+			self.serial.open()
+		
+		self.output = OutputStage(self.serial, flush_policy, self.clock)
 	
 	def start(self):
 		if self.DEBUG_MODE:
@@ -173,53 +382,32 @@ class EFM100Emu():
 		self.txthread.start()
 	
 	def toggleFault(self):
-		self.fault = not self.fault
+		with self.lock:
+			self.fault = not self.fault
+			
+			return self.fault
 	
 	def txThread(self):
 		if self.DEBUG_MODE:
 			self.log("txThread", "Information", "Running...")
 		
 		
-		last_status = time.time()
+		deadline = self.next_status
 		
-		while self.txthread_alive:
-			now = time.time()
-			last_status_diff = (now - last_status)
+		self.output.claim()
+		
+		while self.txthread_alive and not self.clock.expired():
+			# Sleep until the sentence is due, something has been handed over to write or the line can take what's held back
+			timeout = deadline - self.clock.monotonic()
+			
+			if timeout > 0.:
+				self.clock.wait(self.output.waker, timeout)
+			
+			if not self.txthread_alive:
+				break
 			
-			if last_status_diff >= 0.1:
-				# Transmit the status straight away
-				s = bytearray()
-				
-				if self.efl >= 0.:
-					s.extend(self.EFM_POSITIVE) # <p>
-					s.extend("%2.2f" % float(self.efl)) # <ee.ee>
-					
-				else:
-					s.extend(self.EFM_NEGATIVE) # <p>
-					s.extend("%2.2f" % -float(self.efl)) # <ee.ee>
-				
-				s.extend(",")
-				
-				s.extend("%d" % int(self.fault)) # <f>
-				
-				s.extend("*")
-				
-				c = self.checksum(str(s))
-				s.extend(c) # <cs>
-				
-				s.extend("\r\n")
-				
-				
-				lock = threading.Lock()
-				
-				with lock:
-					self.serial.write(str(s))
-					self.serial.flush()
-				
-				
-				last_status = time.time()
 			
-			time.sleep(0.01)
+			deadline = self.service(self.clock.monotonic())
 
 
 
@@ -391,11 +579,30 @@ def main():
 	
 	log("main", "Information", "Setting up...")
 	
-	efmunit = EFM100Emu(EFM100_PORT, EFM100_SPEED, EFM100_BITS, EFM100_PARITY, EFM100_STOPBITS, DEBUG_MODE)
+	efmunit = EFM100Emu(EFM100_PORT, EFM100_SPEED, EFM100_BITS, EFM100_PARITY, EFM100_STOPBITS, DEBUG_MODE, EFM100_FLUSH_POLICY, EFM100_TCP_BUFFER, EFM100_TCP_OVERFLOW, clock = newClock(EFM100_CLOCK_SPEED, EFM100_RUN_FOR), catchup = EFM100_CATCHUP, rate = EFM100_RATE, pacing = EFM100_LINE_PACING, autostart = False)
+	
+	if EFM100_RECORD_FILE <> "":
+		log("main", "Information", "Recording everything sent to %s..." % EFM100_RECORD_FILE)
+		
+		recorder = SentenceRecorder(EFM100_RECORD_FILE, EFM100_RECORD_COMPRESS)
+		recorder.start()
+		
+		efmunit.output.recorder = recorder
+	
+	if EFM100_REPLAY_FILE <> "":
+		log("main", "Information", "Replaying %s at %sx from %.1f seconds in..." % (EFM100_REPLAY_FILE, iif(EFM100_REPLAY_SPEED > 0., EFM100_REPLAY_SPEED, "max"), EFM100_REPLAY_START))
+		
+		CaptureReplay(efmunit, EFM100_REPLAY_FILE, EFM100_REPLAY_SPEED, EFM100_REPLAY_START).start()
+	
+	# Only once it's all in place so the replay, if any, replaces the unit's sentences from the start
+	efmunit.start()
 	
 	
 	log("main", "Information", "Starting...")
 	
+	if not sys.stdin.isatty():
+		runHeadless()
+	
 	while True:
 		try:
 			print """
@@ -413,19 +620,13 @@ Choice:""",
 			
 			if len(i) == 1:
 				if i == "a":
-					efmunit.adjustElectricFieldLevel(0.5)
-					
-					print "Increase field level - now set to %2.2fKV" % efmunit.efl
+					print "Increase field level - now set to %2.2fKV" % efmunit.adjustElectricFieldLevel(0.5)
 				
 				elif i == "z":
-					efmunit.adjustElectricFieldLevel(-0.5)
-					
-					print "Decrease field level - now set to %2.2fKV" % efmunit.efl
+					print "Decrease field level - now set to %2.2fKV" % efmunit.adjustElectricFieldLevel(-0.5)
 					
 				elif i == "x":
-					efmunit.toggleFault()
-					
-					print "Fault is now %s" % iif(efmunit.fault, "active", "inactive")
+					print "Fault is now %s" % iif(efmunit.toggleFault(), "active", "inactive")
 					
 				elif i == "q":
 					print "Quit"
@@ -442,12 +643,131 @@ Choice:""",
 	log("main", "Information", "Exiting...")
 	exitProgram()
 
+def parseSwitch(value, toggle):
+	value = value.lower()
+	
+	if value == "toggle":
+		return toggle()
+		
+	elif value in ["on", "1", "true"]:
+		return True
+		
+	elif value in ["off", "0", "false"]:
+		return False
+		
+	else:
+		raise ValueError("\"%s\" should be on, off or toggle." % value)
+
+def runCommand(line):
+	#
+	# Headless commands, one per line: -
+	#
+	# field <kv>
+	# adjust <kv>
+	# fault on|off|toggle
+	# rate [<hz>]
+	# status
+	# jitter
+	# line
+	# output
+	# quit
+	#
+	args = line.split()
+	
+	if len(args) == 0 or args[0].startswith("#"):
+		return None
+	
+	command = args[0].lower()
+	
+	if command == "field" and len(args) == 2:
+		return "Field level is now %2.2fKV" % efmunit.setElectricFieldLevel(float(args[1]))
+		
+	elif command == "adjust" and len(args) == 2:
+		return "Field level is now %2.2fKV" % efmunit.adjustElectricFieldLevel(float(args[1]))
+		
+	elif command == "fault" and len(args) == 2:
+		active = parseSwitch(args[1], efmunit.toggleFault)
+		efmunit.setFault(active)
+		
+		return "Fault is now %s" % iif(active, "active", "inactive")
+		
+	elif command == "rate" and len(args) == 1:
+		stats = efmunit.schedule.stats()
+		
+		return "Rate requested %.2fHz, achieved %.2fHz (%.1f%%), %d sentence(s) per wakeup every %.3fms, %d missed" % (stats["requested"], stats["rate"], stats["rate"] / stats["requested"] * 100., efmunit.schedule.batch, stats["period"], stats["missed"])
+		
+	elif command == "rate" and len(args) == 2:
+		return "Rate is now %.2fHz" % efmunit.setRate(float(args[1]))
+		
+	elif command == "status":
+		return "Field level %2.2fKV, fault %s" % (efmunit.efl, iif(efmunit.fault, "active", "inactive"))
+		
+	elif command == "jitter":
+		return "Sentence %s" % formatJitter(efmunit.schedule.stats())
+		
+	elif command == "line":
+		if efmunit.pacer is None:
+			return "Line pacing is off"
+		
+		return "Line %s" % formatLine(efmunit.pacer.stats(efmunit.clock.monotonic()))
+		
+	elif command == "output":
+		return "Output %s" % formatOutput(efmunit.output.stats())
+		
+	elif command == "quit":
+		exitProgram()
+		
+	else:
+		raise ValueError("\"%s\" isn't a valid command." % line.strip())
+
+def runHeadless():
+	if DEBUG_MODE:
+		log("runHeadless", "Information", "Starting...")
+	
+	
+	# No TTY so take commands from stdin instead of the menu, once stdin is
+	# closed carry on emulating until we're interrupted or terminated
+	def terminate(signum, frame):
+		raise KeyboardInterrupt()
+	
+	signal.signal(signal.SIGTERM, terminate)
+	
+	log("runHeadless", "Information", "No TTY, reading commands from stdin...")
+	
+	try:
+		for line in iter(sys.stdin.readline, ""):
+			try:
+				reply = runCommand(line)
+				
+				if reply is not None:
+					print reply
+					
+					sys.stdout.flush()
+				
+			except ValueError, ex:
+				log("runHeadless", "Warning", str(ex))
+		
+		while True:
+			if efmunit.clock.expired() and not efmunit.txthread.isAlive():
+				log("runHeadless", "Information", "The run has finished.")
+				
+				break
+			
+			time.sleep(iif(isinstance(efmunit.clock, VirtualClock), 0.5, 3600.))
+		
+	except KeyboardInterrupt:
+		pass
+	
+	
+	log("main", "Information", "Exiting...")
+	exitProgram()
+
 def xmlEMUSettingsRead():
 	if DEBUG_MODE:
 		log("xmlEMUSettingsRead", "Information", "Starting...")
 	
 	
-	global DEBUG_MODE, EFM100_PARITY, EFM100_PORT, EFM100_SPEED, EFM100_STOPBITS
+	global DEBUG_MODE, EFM100_BITS, EFM100_CATCHUP, EFM100_CLOCK_SPEED, EFM100_FLUSH_POLICY, EFM100_LINE_PACING, EFM100_PARITY, EFM100_PORT, EFM100_RATE, EFM100_RECORD_COMPRESS, EFM100_RECORD_FILE, EFM100_REPLAY_FILE, EFM100_REPLAY_SPEED, EFM100_REPLAY_START, EFM100_RUN_FOR, EFM100_SPEED, EFM100_STOPBITS, EFM100_TCP_BUFFER, EFM100_TCP_OVERFLOW
 	
 	
 	if os.path.exists(XML_SETTINGS_FILE):
@@ -463,18 +783,57 @@ def xmlEMUSettingsRead():
 				if key == "EFM100Bits":
 					EFM100_BITS = int(val)
 					
+				elif key == "EFM100ClockSpeed":
+					EFM100_CLOCK_SPEED = float(val)
+					
+				elif key == "EFM100FlushPolicy":
+					EFM100_FLUSH_POLICY = val
+					
+				elif key == "EFM100LinePacing":
+					EFM100_LINE_PACING = cBool(val)
+					
 				elif key == "EFM100Parity":
 					EFM100_PARITY = val
 					
 				elif key == "EFM100Port":
 					EFM100_PORT = val
 					
+				elif key == "EFM100Rate":
+					EFM100_RATE = float(val)
+					
+				elif key == "EFM100RecordCompress":
+					EFM100_RECORD_COMPRESS = cBool(val)
+					
+				elif key == "EFM100RecordFile":
+					EFM100_RECORD_FILE = val
+					
+				elif key == "EFM100ReplayFile":
+					EFM100_REPLAY_FILE = val
+					
+				elif key == "EFM100ReplaySpeed":
+					EFM100_REPLAY_SPEED = float(val)
+					
+				elif key == "EFM100ReplayStart":
+					EFM100_REPLAY_START = float(val)
+					
+				elif key == "EFM100RunFor":
+					EFM100_RUN_FOR = float(val)
+					
 				elif key == "EFM100Speed":
 					EFM100_SPEED = int(val)
 					
+				elif key == "EFM100StatusCatchUp":
+					EFM100_CATCHUP = val
+					
 				elif key == "EFM100StopBits":
 					EFM100_STOPBITS = int(val)
 					
+				elif key == "EFM100TCPBuffer":
+					EFM100_TCP_BUFFER = int(val)
+					
+				elif key == "EFM100TCPOverflow":
+					EFM100_TCP_OVERFLOW = val
+					
 				elif key == "DebugMode":
 					DEBUG_MODE = cBool(val)
 					
@@ -517,6 +876,59 @@ def xmlEMUSettingsWrite():
 		var.setAttribute("EFM100StopBits", str(EFM100_STOPBITS))
 		settings.appendChild(var)
 		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100FlushPolicy", str(EFM100_FLUSH_POLICY))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100LinePacing", str(EFM100_LINE_PACING))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100TCPBuffer", str(EFM100_TCP_BUFFER))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100TCPOverflow", str(EFM100_TCP_OVERFLOW))
+		settings.appendChild(var)
+		
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100ClockSpeed", str(EFM100_CLOCK_SPEED))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100RunFor", str(EFM100_RUN_FOR))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100Rate", str(EFM100_RATE))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100StatusCatchUp", str(EFM100_CATCHUP))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100RecordFile", str(EFM100_RECORD_FILE))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100RecordCompress", str(EFM100_RECORD_COMPRESS))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100ReplayFile", str(EFM100_REPLAY_FILE))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100ReplaySpeed", str(EFM100_REPLAY_SPEED))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("EFM100ReplayStart", str(EFM100_REPLAY_START))
+		settings.appendChild(var)
+		
 		
 		var = xmldoc.createElement("Setting")
 		var.setAttribute("DebugMode", str(DEBUG_MODE))
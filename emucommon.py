@@ -0,0 +1,2341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#########################################################################
+# Copyright/License Notice (BSD License)                                #
+#########################################################################
+#########################################################################
+# Copyright (c) 2011, Daniel Knaggs                                     #
+# All rights reserved.                                                  #
+#                                                                       #
+# Redistribution and use in source and binary forms, with or without    #
+# modification, are permitted provided that the following conditions    #
+# are met: -                                                            #
+#                                                                       #
+#   * Redistributions of source code must retain the above copyright    #
+#     notice, this list of conditions and the following disclaimer.     #
+#                                                                       #
+#   * Redistributions in binary form must reproduce the above copyright #
+#     notice, this list of conditions and the following disclaimer in   #
+#     the documentation and/or other materials provided with the        #
+#     distribution.                                                     #
+#                                                                       #
+#   * Neither the name of the author nor the names of its contributors  #
+#     may be used to endorse or promote products derived from this      #
+#     software without specific prior written permission.               #
+#                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS   #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT     #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR #
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT  #
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, #
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT      #
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, #
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY #
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT   #
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  #
+#########################################################################
+
+
+
+###################################################
+# Boltek Emulator Common Routines                 #
+###################################################
+# Version:     v0.1.2                             #
+###################################################
+
+
+from bisect import bisect_right
+import calendar
+from collections import deque
+import heapq
+import math
+import mmap
+import os
+import random
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+
+
+#############
+# Constants #
+#############
+ARCHIVE_CHUNK = 1048576
+ARCHIVE_REPORT_INTERVAL = 10.
+
+CAPTURE_HOLD = 1024
+CAPTURE_HOLD_WAIT = 0.01
+CAPTURE_INDEX_EXTENSION = ".idx"
+CAPTURE_INDEX_HEADER = "<8sQQ"
+CAPTURE_INDEX_ENTRY = "<dQ"
+CAPTURE_INDEX_INTERVAL = 1024
+CAPTURE_INDEX_MAGIC = "BEMUIDX1"
+
+CATCHUP_BURST = "burst"
+CATCHUP_RESYNC = "resync"
+CATCHUP_SKIP = "skip"
+
+CATCHUP_MAX_BURST = 10
+CATCHUP_POLICIES = [CATCHUP_BURST, CATCHUP_RESYNC, CATCHUP_SKIP]
+
+DISTRIBUTION_NORMAL = "normal"
+DISTRIBUTION_UNIFORM = "uniform"
+
+DISTRIBUTIONS = [DISTRIBUTION_NORMAL, DISTRIBUTION_UNIFORM]
+
+EARTH_RADIUS = 3958.8 # Miles
+
+FIELD_FAIR_WEATHER = 0.2
+FIELD_RECOVERY = 5.
+FIELD_STORM_PEAK = 10.
+FIELD_STORM_SCALE = 10.
+FIELD_STRIKE_RANGE = 20.
+FIELD_STRIKE_SCALE = 5.
+FIELD_STRIKE_STEP = 8.
+
+FILE_PREFIX = "file"
+
+FLUSH_BATCH = "batch"
+FLUSH_NEVER = "never"
+FLUSH_SENTENCE = "sentence"
+
+FLASH_BEARING_SCATTER = 1.
+FLASH_DISTANCE_SCATTER = 2.
+FLASH_INTERVAL = (0.02, 0.1)
+FLASH_STROKES = (3, 15)
+
+FLUSH_POLICIES = [FLUSH_BATCH, FLUSH_NEVER, FLUSH_SENTENCE]
+
+PACE_FIFO = 16
+
+PTY_BUFFER = 65536
+PTY_PREFIX = "pty"
+
+RECORD_BLOCK_HEADER = "<BIIqd"
+RECORD_BLOCK_SIZE = 65536
+RECORD_COMPRESSED = 1
+RECORD_FLUSH_INTERVAL = 1.
+RECORD_MAGIC = "BEMUREC1"
+
+STORM_CELL_RADIUS = 4.
+STORM_LIFETIME = (1800., 5400.)
+STORM_PEAK_RATE = (20., 300.)
+STORM_RANGE = 300.
+STORM_SPAWN_INTERVAL = 900.
+STORM_SPEED = (5., 40.)
+STORM_STEP = 0.1
+
+STRIKE_RATE_WINDOW = 60
+
+TCP_BUFFER = 65536
+TCP_OVERFLOW_DISCONNECT = "disconnect"
+TCP_OVERFLOW_DROP = "drop"
+TCP_OVERFLOW_POLICIES = [TCP_OVERFLOW_DISCONNECT, TCP_OVERFLOW_DROP]
+TCP_PREFIX = "tcp"
+
+TIMER_SPIN = 0.002
+
+
+###########
+# Classes #
+###########
+class ArchiveIngest():
+	#
+	# Archive file format, CSV with one strike per line: -
+	#
+	# <timestamp>,<latitude>,<longitude>[,anything else...]
+	#
+	# <timestamp> is either seconds since the epoch or UTC in ISO 8601 form
+	# (e.g. 2011-05-21T14:03:27.125Z), lines must be in time order within
+	# each file.  A header line, blank lines and lines starting with # are
+	# skipped.
+	#
+	# Each file is read ARCHIVE_CHUNK bytes at a time and every chunk is
+	# projected onto the unit's station in one go (see GeoProjector), the
+	# files are then merged by timestamp with a k-way merge holding only
+	# the next strike from each.  So however big the archives are memory
+	# stays at about a chunk per file, the unit's transmit queue does the
+	# rest (with the block policy the ingest waits for the line).
+	#
+	# speed is a multiplier on the archive's timing, 0 sends as fast as the
+	# unit will take it.  The strikes go through the unit's transmit queue
+	# like any others, so they count towards the status rates and alarms.
+	def __init__(self, unit, paths, speed = 1.):
+		self.alive = False
+		self.bytes = 0
+		self.errors = 0
+		self.finished = None
+		self.in_range = 0
+		self.last_report = None
+		self.out_of_order = 0
+		self.paths = paths
+		self.rows = 0
+		self.sent = 0
+		self.speed = float(speed)
+		self.started = None
+		self.thread = None
+		self.unit = unit
+	
+	def ingestThread(self):
+		batch = []
+		clock = self.unit.clock
+		first = None
+		started = clock.monotonic()
+		
+		try:
+			for t, distance, bearing in heapq.merge(*[self.readArchive(path) for path in self.paths]):
+				if not self.alive:
+					break
+				
+				if first is None:
+					first = t
+				
+				if self.speed > 0.:
+					delay = started + (t - first) / self.speed - clock.monotonic()
+					
+					if delay > 0.:
+						# Send everything that was due before sleeping until this one is
+						self.writeBatch(batch)
+						batch = []
+						
+						clock.sleep(delay)
+				
+				batch.append((distance, bearing))
+				
+				if len(batch) >= 256:
+					self.writeBatch(batch)
+					batch = []
+			
+			self.writeBatch(batch)
+			
+		except Exception, ex:
+			self.unit.log("ingestThread", "Exception", str(ex))
+			
+		finally:
+			self.alive = False
+			self.finished = time.time()
+			self.unit.archive = None
+			
+			self.unit.log("ingestThread", "Information", "Archive ingest finished, %s." % formatIngest(self.stats()))
+	
+	def parseTimestamp(self, value, cache):
+		# cache holds the last whole second parsed, archives have many strikes a second
+		try:
+			return float(value)
+			
+		except ValueError:
+			pass
+		
+		
+		if len(value) < 19 or value[10] not in "T ":
+			raise ValueError("Timestamp \"%s\" isn't valid." % value)
+		
+		if cache[0] <> value[:19]:
+			cache[0] = value[:19]
+			cache[1] = calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]), int(value[11:13]), int(value[14:16]), int(value[17:19]), 0, 0, 0))
+		
+		fraction = value[19:].rstrip("Z")
+		
+		if fraction <> "":
+			return cache[1] + float(fraction)
+		
+		return cache[1]
+	
+	def readArchive(self, path):
+		# Yields (timestamp, distance, bearing) of the strikes in range, in time order
+		cache = [None, 0.]
+		f = open(path, "rb")
+		last = None
+		
+		try:
+			while self.alive:
+				lines = f.readlines(ARCHIVE_CHUNK)
+				
+				if len(lines) == 0:
+					break
+				
+				
+				times = []
+				latitudes = []
+				longitudes = []
+				
+				for line in lines:
+					self.bytes += len(line)
+					
+					line = line.strip()
+					
+					if len(line) == 0 or line.startswith("#"):
+						continue
+					
+					fields = line.split(",", 3)
+					
+					try:
+						t = self.parseTimestamp(fields[0].strip(), cache)
+						latitude = float(fields[1])
+						longitude = float(fields[2])
+						
+					except (IndexError, ValueError):
+						# Most likely the header
+						self.errors += 1
+						
+						continue
+					
+					if last is not None and t < last:
+						# Keep the merge in order, it goes out with the strike before it
+						self.out_of_order += 1
+						
+						t = last
+					
+					last = t
+					
+					times.append(t)
+					latitudes.append(latitude)
+					longitudes.append(longitude)
+				
+				self.rows += len(times)
+				
+				strikes = self.unit.geo.locate(latitudes, longitudes)
+				
+				self.in_range += len(strikes)
+				
+				for index, distance, bearing in strikes:
+					yield (times[index], distance, bearing)
+			
+		finally:
+			f.close()
+	
+	def start(self):
+		if self.unit.geo is None:
+			raise ValueError("The station location hasn't been set.")
+		
+		
+		self.alive = True
+		self.started = time.time()
+		self.unit.archive = self
+		
+		self.thread = threading.Thread(target = self.ingestThread)
+		self.thread.setDaemon(1)
+		self.thread.start()
+	
+	def stats(self):
+		elapsed = max((self.finished or time.time()) - (self.started or time.time()), 1e-6)
+		
+		return {"files": len(self.paths), "rows": self.rows, "in_range": self.in_range, "sent": self.sent, "errors": self.errors, "out_of_order": self.out_of_order, "bytes": self.bytes, "elapsed": elapsed, "rows_rate": self.rows / elapsed, "sent_rate": self.sent / elapsed, "byte_rate": self.bytes / elapsed}
+	
+	def stop(self):
+		self.alive = False
+		
+		if self.thread is not None and self.thread is not threading.currentThread():
+			self.thread.join(1.)
+			self.thread = None
+	
+	def writeBatch(self, batch):
+		if len(batch) > 0:
+			self.unit.addStrikesToQueue(batch)
+			
+			self.sent += len(batch)
+		
+		
+		now = time.time()
+		
+		if self.last_report is None:
+			self.last_report = now
+			
+		elif now - self.last_report >= ARCHIVE_REPORT_INTERVAL:
+			self.last_report = now
+			
+			self.unit.log("ingestThread", "Information", "Archive ingest %s." % formatIngest(self.stats()))
+
+class CaptureReplay():
+	#
+	# Capture file format, one sentence per line: -
+	#
+	# <timestamp> <sentence>
+	#
+	# <timestamp> is in seconds (e.g. from time.time()) and lines must be in
+	# time order, blank lines and lines starting with # are skipped.  Lines
+	# which can't be read (truncated or without a timestamp) are skipped and
+	# counted, the count is logged when the index is built and at the end.
+	#
+	# The capture is memory-mapped and a sidecar index (<capture>.idx) holding
+	# the timestamp and offset of every CAPTURE_INDEX_INTERVAL'th line is
+	# built the first time it's used, so seeking into the middle of a huge
+	# capture only reads the lines from the nearest index entry onwards.
+	#
+	# speed is a multiplier on the captured timing, 0 plays as fast as the
+	# port will take it.  With pacing the line decides, the replay waits
+	# while more than CAPTURE_HOLD sentences are held back for it.  While
+	# replaying the unit doesn't generate its own sentences, anything queued
+	# by hand still goes out.
+	def __init__(self, unit, path, speed = 1., start = 0.):
+		self.alive = False
+		self.capture = None
+		self.errors = 0
+		self.index_offsets = []
+		self.index_times = []
+		self.path = path
+		self.position = 0
+		self.sentences = 0
+		self.speed = float(speed)
+		self.start_offset = float(start)
+		self.thread = None
+		self.unit = unit
+	
+	def buildIndex(self):
+		index_path = self.path + CAPTURE_INDEX_EXTENSION
+		st = os.stat(self.path)
+		
+		
+		# Use the existing index if it was built from this version of the capture
+		if os.path.exists(index_path):
+			f = open(index_path, "rb")
+			data = f.read()
+			f.close()
+			
+			header = struct.calcsize(CAPTURE_INDEX_HEADER)
+			
+			if len(data) >= header:
+				magic, size, mtime = struct.unpack(CAPTURE_INDEX_HEADER, data[:header])
+				
+				if magic == CAPTURE_INDEX_MAGIC and size == st.st_size and mtime == int(st.st_mtime):
+					entry = struct.calcsize(CAPTURE_INDEX_ENTRY)
+					
+					for x in range(header, len(data) - entry + 1, entry):
+						t, offset = struct.unpack(CAPTURE_INDEX_ENTRY, data[x:x + entry])
+						
+						self.index_times.append(t)
+						self.index_offsets.append(offset)
+					
+					return
+		
+		
+		f = open(index_path + ".tmp", "wb")
+		f.write(struct.pack(CAPTURE_INDEX_HEADER, CAPTURE_INDEX_MAGIC, st.st_size, int(st.st_mtime)))
+		
+		lines = 0
+		
+		for t, sentence, offset in self.readLines(0):
+			if lines % CAPTURE_INDEX_INTERVAL == 0:
+				f.write(struct.pack(CAPTURE_INDEX_ENTRY, t, offset))
+				
+				self.index_times.append(t)
+				self.index_offsets.append(offset)
+			
+			lines += 1
+		
+		f.close()
+		
+		os.rename(index_path + ".tmp", index_path)
+		
+		if self.errors > 0:
+			self.unit.log("buildIndex", "Warning", "%d unreadable line(s) in %s will be skipped." % (self.errors, self.path))
+	
+	def close(self):
+		self.stop()
+		
+		if self.capture is not None:
+			self.capture.close()
+			self.capture = None
+	
+	def open(self):
+		f = open(self.path, "rb")
+		
+		try:
+			self.capture = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+			
+		finally:
+			f.close()
+		
+		self.buildIndex()
+	
+	def readLines(self, position):
+		# Yields (timestamp, sentence, offset of the line) from position onwards
+		capture = self.capture
+		end = len(capture)
+		
+		while position < end:
+			x = capture.find("\n", position)
+			
+			if x == -1:
+				x = end
+			
+			line = capture[position:x].strip()
+			
+			if len(line) > 0 and not line.startswith("#"):
+				fields = line.split(None, 1)
+				
+				try:
+					t = float(fields[0])
+					
+					if len(fields) < 2:
+						raise ValueError("No sentence")
+					
+				except ValueError:
+					self.errors += 1
+					
+				else:
+					yield (t, fields[1], position)
+			
+			position = x + 1
+	
+	def replayThread(self):
+		batch = []
+		clock = self.unit.clock
+		first = None
+		started = clock.monotonic()
+		
+		try:
+			for t, sentence, offset in self.readLines(self.position):
+				if not self.alive:
+					break
+				
+				if first is None:
+					first = t
+				
+				if self.speed > 0.:
+					delay = started + (t - first) / self.speed - clock.monotonic()
+					
+					if delay > 0.:
+						# Send everything that was due before sleeping until this one is
+						self.writeBatch(batch)
+						batch = []
+						
+						clock.sleep(delay)
+				
+				batch.append(sentence + "\r\n")
+				
+				self.position = offset
+				
+				if len(batch) >= 256:
+					self.writeBatch(batch)
+					batch = []
+			
+			self.writeBatch(batch)
+			
+		except Exception, ex:
+			self.unit.log("replayThread", "Exception", str(ex))
+			
+		finally:
+			self.alive = False
+			self.unit.replay = None
+			
+			self.unit.log("replayThread", "Information", "Capture replay finished, %d sentence(s) sent, %d unreadable line(s) skipped." % (self.sentences, self.errors))
+	
+	def seek(self, timestamp):
+		# Jump to the last indexed line before timestamp then walk forward to it
+		i = max(bisect_right(self.index_times, timestamp) - 1, 0)
+		
+		if len(self.index_offsets) == 0:
+			return
+		
+		for t, sentence, offset in self.readLines(self.index_offsets[i]):
+			self.position = offset
+			
+			if t >= timestamp:
+				break
+	
+	def start(self):
+		if self.capture is None:
+			self.open()
+		
+		if len(self.index_times) > 0:
+			self.seek(self.index_times[0] + self.start_offset)
+		
+		# Only count what's skipped from here on
+		self.errors = 0
+		
+		
+		self.alive = True
+		self.unit.replay = self
+		
+		self.thread = threading.Thread(target = self.replayThread)
+		self.thread.setDaemon(1)
+		self.thread.start()
+	
+	def stop(self):
+		self.alive = False
+		
+		if self.thread is not None and self.thread is not threading.currentThread():
+			self.thread.join(1.)
+			self.thread = None
+	
+	def writeBatch(self, batch):
+		if len(batch) > 0:
+			output = self.unit.output
+			
+			while self.alive and len(output.held) + len(output.handoff) > CAPTURE_HOLD:
+				self.unit.clock.sleep(CAPTURE_HOLD_WAIT)
+			
+			output.submit(batch)
+			
+			self.sentences += len(batch)
+
+class FieldModel():
+	# The electric field an EFM-100 at the station would see from a
+	# StormModel, in KV.  Fair weather gives a small positive field, each
+	# storm cell pulls it negative by up to FIELD_STORM_PEAK at its peak
+	# rate falling away with distance (half at FIELD_STORM_SCALE miles), so
+	# an approaching cell builds the field up.  A strike within
+	# FIELD_STRIKE_RANGE miles throws the field the other way, by up to
+	# FIELD_STRIKE_STEP overhead, which then recovers with a time constant of
+	# FIELD_RECOVERY seconds.
+	#
+	# The model hooks itself onto the storm's strike_callback, so the field
+	# follows whatever the LD-250 driving the storm sends.
+	def __init__(self, storm):
+		self.excursion = 0.
+		self.last = None
+		self.lock = threading.Lock()
+		self.storm = storm
+		
+		storm.strike_callback = self.addStrikes
+	
+	def addStrikes(self, strikes, now):
+		with self.lock:
+			self.decay(now)
+			
+			background = FIELD_FAIR_WEATHER + self.background()
+			
+			for distance, bearing in strikes:
+				if distance <= FIELD_STRIKE_RANGE:
+					step = FIELD_STRIKE_STEP / (1. + (distance / FIELD_STRIKE_SCALE) ** 2)
+					
+					# Against the field as it stands, which is what flips its polarity
+					if background + self.excursion < 0.:
+						self.excursion += step
+						
+					else:
+						self.excursion -= step
+	
+	def background(self):
+		# The cells' contribution, called with the lock held
+		field = 0.
+		
+		for cell in self.storm.cells:
+			if cell.alive:
+				field -= FIELD_STORM_PEAK * cell.rate() / STORM_PEAK_RATE[1] / (1. + (cell.distance() / FIELD_STORM_SCALE) ** 2)
+		
+		return field
+	
+	def decay(self, now):
+		# Called with the lock held
+		if self.last is not None and now > self.last:
+			self.excursion *= math.exp(-(now - self.last) / FIELD_RECOVERY)
+		
+		if self.last is None or now > self.last:
+			self.last = now
+	
+	def level(self, now):
+		with self.lock:
+			self.decay(now)
+			
+			return min(max(FIELD_FAIR_WEATHER + self.background() + self.excursion, -20.), 20.)
+
+class FilePort():
+	# Write-only sink which appends everything to a file, mostly useful with a
+	# VirtualClock to generate long runs of output quickly.  Nothing is ever
+	# read so read() just waits for the timeout (or close()).
+	def __init__(self, path, timeout = None):
+		self.file = None
+		self.name = path
+		self.timeout = timeout
+		self.wake_r = None
+		self.wake_w = None
+	
+	def close(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+		
+		if self.wake_w is not None:
+			os.write(self.wake_w, "\x00")
+	
+	def fileno(self):
+		# Nothing to poll for
+		return None
+	
+	def flush(self):
+		self.file.flush()
+	
+	def inWaiting(self):
+		return 0
+	
+	def open(self):
+		self.file = open(self.name, "ab")
+		
+		self.wake_r, self.wake_w = os.pipe()
+	
+	def read(self, size = 1):
+		if self.file is not None:
+			select.select([self.wake_r], [], [], self.timeout)
+		
+		return ""
+	
+	def write(self, data):
+		data = str(data)
+		
+		self.file.write(data)
+		
+		return len(data)
+
+class FlashGenerator():
+	# Turns a lightning flash into its return strokes, between strokes[0] and
+	# strokes[1] of them interval[0] to interval[1] seconds apart.  The first
+	# stroke is where the flash was asked for, the rest wander up to
+	# distance_scatter miles and bearing_scatter degrees from it as the
+	# channel does.
+	def __init__(self, strokes = FLASH_STROKES, interval = FLASH_INTERVAL, distance_scatter = FLASH_DISTANCE_SCATTER, bearing_scatter = FLASH_BEARING_SCATTER, seed = None):
+		if strokes[0] < 1 or strokes[1] < strokes[0]:
+			raise ValueError("Flash strokes %s isn't a valid range." % str(strokes))
+		
+		if interval[0] < 0. or interval[1] < interval[0]:
+			raise ValueError("Flash interval %s isn't a valid range." % str(interval))
+		
+		
+		self.bearing_scatter = bearing_scatter
+		self.distance_scatter = distance_scatter
+		self.interval = interval
+		self.random = random.Random(seed)
+		self.strokes = strokes
+	
+	def flash(self, distance, bearing, start, strokes = None):
+		# Returns the (monotonic time, distance, bearing) of each stroke, the first one at start
+		if strokes is None:
+			strokes = self.random.randint(self.strokes[0], self.strokes[1])
+		
+		uniform = self.random.uniform
+		
+		result = [(start, distance, bearing)]
+		at = start
+		
+		for i in range(1, strokes):
+			at += uniform(self.interval[0], self.interval[1])
+			
+			result.append((at, min(max(int(round(distance + uniform(-self.distance_scatter, self.distance_scatter))), 0), 300), round((bearing + uniform(-self.bearing_scatter, self.bearing_scatter)) % 360., 1) % 360.))
+		
+		return result
+
+class GeoProjector():
+	# Turns strike latitudes/longitudes into the (distance, bearing) the
+	# station at latitude/longitude would see, great-circle distance in
+	# whole miles and bearing to 0.1 degree.  Strikes further away than
+	# max_range miles are left out, those more than max_range worth of
+	# latitude away are thrown out before any trigonometry is done.
+	#
+	# With NumPy installed (and vectorise on) each call works on the whole
+	# batch at once, so millions of points take seconds.
+	def __init__(self, latitude, longitude, max_range = 300., vectorise = True):
+		if latitude < -90. or latitude > 90. or longitude < -180. or longitude > 180.:
+			raise ValueError("Station location %.4f, %.4f isn't valid." % (latitude, longitude))
+		
+		
+		self.cos_latitude = math.cos(math.radians(latitude))
+		self.latitude = latitude
+		self.latitude_window = math.degrees(max_range / EARTH_RADIUS)
+		self.longitude = longitude
+		self.max_range = max_range
+		self.sin_latitude = math.sin(math.radians(latitude))
+		self.vectorise = vectorise and _numpy is not None
+	
+	def locate(self, latitudes, longitudes):
+		# Returns (index, distance, bearing) for the strikes in range, in the order given
+		if self.vectorise:
+			return self.locateNumPy(latitudes, longitudes)
+		
+		
+		cos = math.cos
+		sin = math.sin
+		radians = math.radians
+		
+		half_latitude = radians(self.latitude) / 2.
+		
+		strikes = []
+		append = strikes.append
+		
+		for index, (latitude, longitude) in enumerate(zip(latitudes, longitudes)):
+			if abs(latitude - self.latitude) > self.latitude_window:
+				continue
+			
+			phi = radians(latitude)
+			cos_phi = cos(phi)
+			sin_phi = sin(phi)
+			delta = radians(longitude - self.longitude)
+			
+			# Haversine
+			a = sin(phi / 2. - half_latitude) ** 2 + self.cos_latitude * cos_phi * sin(delta / 2.) ** 2
+			distance = 2. * EARTH_RADIUS * math.asin(math.sqrt(min(a, 1.)))
+			
+			if distance > self.max_range:
+				continue
+			
+			bearing = math.degrees(math.atan2(sin(delta) * cos_phi, self.cos_latitude * sin_phi - self.sin_latitude * cos_phi * cos(delta)))
+			
+			append((index, int(distance), (int(round(bearing * 10.)) % 3600) / 10.))
+		
+		return strikes
+	
+	def locateNumPy(self, latitudes, longitudes):
+		np = _numpy
+		
+		latitudes = np.asarray(latitudes, dtype = float)
+		longitudes = np.asarray(longitudes, dtype = float)
+		
+		near = np.abs(latitudes - self.latitude) <= self.latitude_window
+		phi = np.radians(latitudes[near])
+		delta = np.radians(longitudes[near] - self.longitude)
+		
+		cos_phi = np.cos(phi)
+		sin_phi = np.sin(phi)
+		
+		# Haversine
+		a = np.sin((phi - math.radians(self.latitude)) / 2.) ** 2 + self.cos_latitude * cos_phi * np.sin(delta / 2.) ** 2
+		distances = 2. * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+		
+		inside = distances <= self.max_range
+		cos_phi = cos_phi[inside]
+		delta = delta[inside]
+		
+		bearings = np.degrees(np.arctan2(np.sin(delta) * cos_phi, self.cos_latitude * sin_phi[inside] - self.sin_latitude * cos_phi * np.cos(delta)))
+		tenths = np.mod(np.rint(bearings * 10.).astype(int), 3600)
+		
+		return zip(np.flatnonzero(near)[inside].tolist(), distances[inside].astype(int).tolist(), (tenths / 10.).tolist())
+	
+	def strikes(self, latitudes, longitudes):
+		# Returns a list of (distance, bearing) for the strikes in range, in the order given
+		return [(distance, bearing) for index, distance, bearing in self.locate(latitudes, longitudes)]
+
+class LatencyStats():
+	# Count, mean and maximum of a latency
+	def __init__(self):
+		self.count = 0
+		self.maximum = 0.
+		self.total = 0.
+	
+	def add(self, latency):
+		self.count += 1
+		self.maximum = max(self.maximum, latency)
+		self.total += latency
+	
+	def stats(self):
+		# In milliseconds
+		return {"count": self.count, "mean": self.total / max(self.count, 1) * 1000., "max": self.maximum * 1000.}
+
+class LinePacer():
+	# Models how long the configured serial line takes to carry the bytes so
+	# pty, TCP and file ports see the same throughput as the real hardware,
+	# each byte costs a start bit, the data bits, the parity bit (if any) and
+	# the stop bits, 9600 8N1 therefore carries 960 bytes a second.
+	#
+	# free_at is when the line will have sent everything given to it so far.
+	# A sentence may start while no more than fifo bytes (the UART's transmit
+	# FIFO) are still waiting to go, sentences are never split.  What doesn't
+	# fit stays with the unit and shows up as queue growth or drops.
+	def __init__(self, speed, bits, parity, stopbits, fifo = PACE_FIFO):
+		parity_bits = 0
+		
+		if str(parity).upper() <> "N":
+			parity_bits = 1
+		
+		
+		self.byte_time = (1. + int(bits) + parity_bits + float(stopbits)) / float(speed)
+		self.fifo = fifo
+		self.free_at = 0.
+		
+		self.bytes = 0
+		self.deferred = 0
+		self.dropped = 0
+		self.first_at = None
+	
+	def available(self, now):
+		# Bytes which may be started now, the last sentence started can run past this
+		backlog = max(0., self.free_at - now) / self.byte_time
+		
+		if backlog > self.fifo + 1e-6:
+			return 0
+		
+		return self.fifo - backlog + 1.
+	
+	def before(self, deadline, now):
+		# Bytes which may be started now and still leave the line free to start a sentence at deadline
+		return (deadline - max(self.free_at, now)) / self.byte_time + self.fifo
+	
+	def consume(self, count, now):
+		if count == 0:
+			return
+		
+		if self.first_at is None:
+			self.first_at = now
+		
+		self.bytes += count
+		self.free_at = max(self.free_at, now) + count * self.byte_time
+	
+	def readyAt(self):
+		# When the next sentence can start
+		return self.free_at - self.fifo * self.byte_time
+	
+	def stats(self, now):
+		utilisation = 0.
+		
+		if self.first_at is not None and now > self.first_at:
+			utilisation = min(self.bytes * self.byte_time / (now - self.first_at), 1.)
+		
+		return {"capacity": 1. / self.byte_time, "bytes": self.bytes, "backlog": max(0., self.free_at - now) / self.byte_time, "utilisation": utilisation * 100., "deferred": self.deferred, "dropped": self.dropped}
+	
+	def take(self, lengths, now):
+		# How many of the sentences with these lengths fit on the line now, consuming them
+		budget = self.available(now)
+		count = 0
+		taken = 0
+		
+		for length in lengths:
+			if taken >= budget:
+				break
+			
+			count += 1
+			taken += length
+		
+		self.consume(taken, now)
+		
+		return count
+
+class OutputStage():
+	#
+	# Flush policies:
+	#
+	# batch    = write all the ready sentences at once then flush
+	# never    = write and let the OS drain the port in the background
+	# sentence = write and flush each sentence on its own (original behaviour)
+	#
+	# On pyserial flush() blocks until the bytes have physically left the port
+	# so at 9600 baud a flush per sentence costs tens of milliseconds each.
+	#
+	# Each unit's output has one owner, the thread which services the unit
+	# (its transmit thread or the fleet host) after calling claim().  Anything
+	# else with sentences to send (capture replay) uses submit() which hands
+	# them over through a deque, appending and popping are atomic so the
+	# producers never take a lock, and wakes the owner who writes them ahead
+	# of its own.  Sentences are only ever written whole by the one thread so
+	# they can't interleave on the port.  The lock is kept for units without
+	# an owner, how often it's found held is counted as contention.
+	#
+	# With a pacer handed over sentences count against the line like the
+	# unit's own, whatever doesn't fit is held back (in order) and goes out
+	# ahead of anything handed over later once readyAt() comes.
+	def __init__(self, port, flush_policy = FLUSH_BATCH, clock = None, waker = None):
+		if flush_policy not in FLUSH_POLICIES:
+			raise ValueError("Unknown flush policy \"%s\"." % flush_policy)
+		
+		
+		self.batches = 0
+		self.clock = clock or RealClock()
+		self.flush_policy = flush_policy
+		self.handoff = deque()
+		self.held = deque()
+		self.lock = threading.Lock()
+		self.owner = None
+		self.own_waker = waker is None
+		self.pacer = None
+		self.port = port
+		self.recorder = None
+		self.sentences = 0
+		self.waker = waker or Waker()
+		
+		self.contended = 0
+		self.handoffs = 0
+		self.handoff_latency = LatencyStats()
+	
+	def claim(self):
+		# The calling thread becomes the only one which writes to the port
+		self.owner = threading.currentThread().ident
+	
+	def clearWake(self):
+		# The owner calls this at the start of every pass, before looking at the handoff, so
+		# whatever is handed over after that wakes it again and a stale wakeup can't spin it
+		if self.own_waker:
+			self.waker.clear()
+	
+	def close(self):
+		if self.recorder is not None:
+			self.recorder.close()
+			self.recorder = None
+		
+		if self.own_waker:
+			self.waker.close()
+	
+	def readyAt(self):
+		# When the held back sentences can go, None if there aren't any
+		if len(self.held) == 0:
+			return None
+		
+		return self.pacer.readyAt()
+	
+	def stats(self):
+		latency = self.handoff_latency.stats()
+		
+		return {"batches": self.batches, "sentences": self.sentences, "handoffs": self.handoffs, "handoff_mean": latency["mean"], "handoff_max": latency["max"], "held": len(self.held), "contended": self.contended}
+	
+	def submit(self, sentences):
+		# For any thread, the owner writes them the next time it runs
+		if self.owner is None or self.owner == threading.currentThread().ident:
+			self.writeBatch(sentences)
+			
+		else:
+			self.handoff.append((self.clock.monotonic(), sentences))
+			self.waker.wake()
+	
+	def write(self, sentence):
+		self.writeBatch([sentence])
+	
+	def writeBatch(self, sentences):
+		if len(sentences) == 0 and len(self.handoff) == 0 and len(self.held) == 0:
+			return
+		
+		
+		# Taken for the handoff as well, until the owner has claimed the output a submit() writes from its own thread
+		if not self.lock.acquire(False):
+			self.contended += 1
+			self.lock.acquire()
+		
+		try:
+			if len(self.handoff) > 0:
+				now = self.clock.monotonic()
+				
+				while len(self.handoff) > 0:
+					submitted, batch = self.handoff.popleft()
+					
+					self.held.extend(batch)
+					
+					self.handoffs += 1
+					self.handoff_latency.add(now - submitted)
+			
+			if len(self.held) > 0:
+				count = len(self.held)
+				
+				if self.pacer is not None:
+					# Only what the line has room for after the unit's own sentences (already charged by the unit)
+					count = self.pacer.take((len(s) for s in self.held), self.clock.monotonic())
+					
+					if count < len(self.held):
+						self.pacer.deferred += 1
+				
+				sentences = [self.held.popleft() for x in xrange(count)] + list(sentences)
+			
+			if len(sentences) == 0:
+				return
+			
+			
+			if self.recorder is not None:
+				self.recorder.record(sentences, self.clock.monotonic(), self.clock.time())
+			
+			if self.flush_policy == FLUSH_SENTENCE:
+				for s in sentences:
+					self.port.write(str(s))
+					self.port.flush()
+				
+			else:
+				self.port.write("".join([str(s) for s in sentences]))
+				
+				if self.flush_policy == FLUSH_BATCH:
+					self.port.flush()
+			
+			self.batches += 1
+			self.sentences += len(sentences)
+			
+		finally:
+			self.lock.release()
+
+class PTYPort():
+	# Pseudo-terminal stand-in for serial.Serial, the consumer under test opens
+	# the slave side (name) like any other serial port so no null-modem cable
+	# or second port is needed.  If a link is given a symlink to the slave is
+	# created there, which gives the consumer a path that doesn't change.
+	#
+	# In non-blocking mode writes which the kernel won't take straight away
+	# are held in pending (up to max_pending bytes, further writes are
+	# dropped) and sent by writePending() once the master becomes writable.
+	def __init__(self, link = None, speed = 9600, timeout = None, max_pending = PTY_BUFFER):
+		self.dropped = 0
+		self.link = link
+		self.master = None
+		self.max_pending = max_pending
+		self.name = None
+		self.nonblocking = False
+		self.pending = bytearray()
+		self.slave = None
+		self.speed = speed
+		self.timeout = timeout
+	
+	def close(self):
+		if self.link is not None and os.path.islink(self.link):
+			os.unlink(self.link)
+		
+		if self.master is not None:
+			os.close(self.master)
+			os.close(self.slave)
+			
+			self.master = None
+			self.slave = None
+	
+	def fileno(self):
+		return self.master
+	
+	def flush(self):
+		# Nothing to drain, the bytes are already in the kernel buffer
+		pass
+	
+	def inWaiting(self):
+		import fcntl
+		import struct
+		import termios
+		
+		
+		return struct.unpack("i", fcntl.ioctl(self.master, termios.FIONREAD, struct.pack("i", 0)))[0]
+	
+	def open(self):
+		if sys.platform.lower() == "win32":
+			raise OSError("Pseudo-terminals aren't available on this platform.")
+		
+		
+		import pty
+		import termios
+		import tty
+		
+		
+		self.master, self.slave = pty.openpty()
+		self.name = os.ttyname(self.slave)
+		
+		# Raw mode on both sides, we don't want the line discipline echoing or translating anything
+		tty.setraw(self.master)
+		tty.setraw(self.slave)
+		
+		speed = getattr(termios, "B%d" % self.speed, None)
+		
+		if speed is not None:
+			attr = termios.tcgetattr(self.slave)
+			attr[4] = speed
+			attr[5] = speed
+			termios.tcsetattr(self.slave, termios.TCSANOW, attr)
+		
+		if self.link is not None:
+			if os.path.islink(self.link):
+				os.unlink(self.link)
+			
+			os.symlink(self.name, self.link)
+	
+	def read(self, size = 1):
+		if self.nonblocking:
+			r = [self.master]
+			
+		else:
+			r, w, x = select.select([self.master], [], [], self.timeout)
+		
+		if len(r) == 0:
+			return ""
+		
+		try:
+			return os.read(self.master, size)
+			
+		except OSError:
+			# EIO is raised on some platforms when the slave side isn't open, EAGAIN when non-blocking
+			return ""
+	
+	def setNonBlocking(self):
+		import fcntl
+		
+		
+		flags = fcntl.fcntl(self.master, fcntl.F_GETFL)
+		fcntl.fcntl(self.master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+		
+		self.nonblocking = True
+	
+	def wantsWrite(self):
+		return len(self.pending) > 0
+	
+	def write(self, data):
+		data = str(data)
+		
+		if self.nonblocking:
+			if len(self.pending) > 0 and len(self.pending) + len(data) > self.max_pending:
+				self.dropped += 1
+				
+			else:
+				self.pending.extend(data)
+				self.writePending()
+			
+			return len(data)
+		
+		
+		sent = 0
+		
+		while sent < len(data):
+			sent += os.write(self.master, data[sent:])
+		
+		return sent
+	
+	def writePending(self):
+		try:
+			sent = os.write(self.master, self.pending)
+			
+		except OSError:
+			return 0
+		
+		del self.pending[:sent]
+		
+		return sent
+
+class RealClock():
+	# The clocks the emulators run on, everything which needs the time or has
+	# to wait for it goes through one so VirtualClock can be swapped in.
+	speed = 1.
+	
+	def expired(self):
+		return False
+	
+	def monotonic(self):
+		return monotonic()
+	
+	def sleep(self, seconds):
+		time.sleep(seconds)
+	
+	def time(self):
+		return time.time()
+	
+	def wait(self, waiter, timeout):
+		return waiter.wait(timeout)
+	
+	def waitUntil(self, waiter, deadline, spin = 0.):
+		# As wait() but to a monotonic deadline.  The kernel can wake us well
+		# after a select() timeout, so the last spin seconds are polled for
+		# instead when the deadline has to be hit to the millisecond.
+		timeout = deadline - monotonic() - spin
+		
+		if timeout > 0. and waiter.wait(timeout):
+			return True
+		
+		while monotonic() < deadline:
+			if waiter.wait(0.):
+				return True
+		
+		return False
+
+class SentenceRecorder():
+	#
+	# Recording file format: -
+	#
+	# RECORD_MAGIC then any number of blocks, each block is a header
+	# (RECORD_BLOCK_HEADER - flags, raw length, stored length, monotonic
+	# microseconds and wall clock time at the start of the block) followed by
+	# the stored bytes, zlib compressed if flags has RECORD_COMPRESSED set.
+	#
+	# The raw bytes are a run of records, each one being a varint of the
+	# microseconds since the previous record (or the block start), a varint
+	# length and the sentence itself.  Sentences written together share the
+	# same timestamp so they only cost two bytes of overhead each.
+	#
+	# Blocks are only ever appended, a block is written out once it reaches
+	# RECORD_BLOCK_SIZE bytes or is RECORD_FLUSH_INTERVAL seconds old.  All the
+	# encoding and file I/O happens on the recorder's own thread, record()
+	# just timestamps the sentences and queues them.
+	def __init__(self, path, compress = True):
+		self.alive = False
+		self.block = bytearray()
+		self.block_started = 0
+		self.block_us = 0
+		self.block_wall = 0.
+		self.compress = compress
+		self.event = threading.Event()
+		self.file = None
+		self.last_us = 0
+		self.path = path
+		self.pending = deque()
+		self.records = 0
+		self.thread = None
+		self.written = 0
+	
+	def close(self):
+		self.alive = False
+		self.event.set()
+		
+		if self.thread is not None:
+			self.thread.join(5.)
+			self.thread = None
+		
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+	
+	def encodeVarint(self, value):
+		while value >= 0x80:
+			self.block.append((value & 0x7f) | 0x80)
+			value >>= 7
+		
+		self.block.append(value)
+	
+	def recordThread(self):
+		while self.alive or len(self.pending) > 0:
+			if len(self.block) > 0:
+				# Come back in time to flush the part block even if nothing more is sent
+				self.event.wait(max(RECORD_FLUSH_INTERVAL - (time.time() - self.block_started), 0.))
+				
+			else:
+				self.event.wait()
+			
+			self.event.clear()
+			
+			while len(self.pending) > 0:
+				us, wall, sentences = self.pending.popleft()
+				
+				if len(self.block) == 0:
+					self.block_started = time.time()
+					self.block_us = us
+					self.block_wall = wall
+					self.last_us = us
+				
+				for sentence in sentences:
+					sentence = str(sentence)
+					
+					self.encodeVarint(us - self.last_us)
+					self.encodeVarint(len(sentence))
+					self.block.extend(sentence)
+					
+					self.last_us = us
+					self.records += 1
+				
+				if len(self.block) >= RECORD_BLOCK_SIZE:
+					self.writeBlock()
+			
+			if len(self.block) > 0 and (not self.alive or time.time() - self.block_started >= RECORD_FLUSH_INTERVAL):
+				self.writeBlock()
+	
+	def record(self, sentences, timestamp = None, wall = None):
+		if timestamp is None:
+			timestamp = monotonic()
+		
+		if wall is None:
+			wall = time.time()
+		
+		
+		self.pending.append((int(timestamp * 1000000.), wall, list(sentences)))
+		
+		if not self.event.isSet():
+			self.event.set()
+	
+	def start(self):
+		new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+		
+		self.file = open(self.path, "ab")
+		
+		if new:
+			self.file.write(RECORD_MAGIC)
+		
+		
+		self.alive = True
+		
+		self.thread = threading.Thread(target = self.recordThread)
+		self.thread.setDaemon(1)
+		self.thread.start()
+	
+	def writeBlock(self):
+		raw = str(self.block)
+		flags = 0
+		
+		if self.compress:
+			raw = zlib.compress(raw, 6)
+			flags |= RECORD_COMPRESSED
+		
+		self.file.write(struct.pack(RECORD_BLOCK_HEADER, flags, len(self.block), len(raw), self.block_us, self.block_wall))
+		self.file.write(raw)
+		self.file.flush()
+		
+		self.written += len(raw) + struct.calcsize(RECORD_BLOCK_HEADER)
+		
+		del self.block[:]
+
+class StatusSchedule():
+	# Absolute deadlines for a periodic sentence on the clock's monotonic
+	# time, slot n is due at origin + n * period so the time taken to write
+	# and any wakeup slop never accumulate into drift.  When whole slots have
+	# been missed (a stalled consumer, the machine being suspended, etc) the
+	# catch-up policy decides what happens: -
+	#
+	# skip   - The missed slots are dropped and we carry on from the next one
+	#          on the original grid (default).
+	# burst  - The missed slots are sent back-to-back (at most max_burst of
+	#          them) then we carry on from the original grid.
+	# resync - The missed slots are dropped and the grid restarts from now.
+	#
+	# At high rates batch slots can be sent per wakeup, deadline() is then
+	# the last slot of the batch and the earlier ones go out with it.
+	#
+	# sent() is called once the sentences have gone out so the statistics are
+	# of what the consumer actually sees, lateness is measured against the
+	# deadline and the interval between one send and the next.
+	def __init__(self, period, origin, catchup = CATCHUP_SKIP, max_burst = CATCHUP_MAX_BURST, batch = 1):
+		if catchup not in CATCHUP_POLICIES:
+			raise ValueError("Catch-up policy \"%s\" isn't known." % catchup)
+		
+		
+		self.batch = max(1, batch)
+		self.catchup = catchup
+		self.max_burst = max(1, max_burst)
+		self.origin = origin
+		self.period = period
+		self.slot = 0
+		
+		self.resetStats()
+	
+	def deadline(self):
+		return self.origin + (self.slot + self.batch - 1) * self.period
+	
+	def due(self, now):
+		# Returns how many sentences should go out now and moves on to the next slot
+		deadline = self.origin + self.slot * self.period
+		
+		if now < deadline:
+			return 0
+		
+		# The small allowance stops float rounding of the deadlines splitting a batch
+		due = int((now - deadline) / self.period + 1e-6) + 1
+		count = min(due, self.batch)
+		behind = due - count
+		
+		self.due_at = deadline + (count - 1) * self.period
+		
+		if behind > 0:
+			extra = 0
+			
+			if self.catchup == CATCHUP_BURST:
+				extra = min(behind, self.max_burst - 1)
+				
+				self.bursts += 1
+			
+			count += extra
+			self.missed += behind - extra
+		
+		if self.catchup == CATCHUP_RESYNC and behind > 0:
+			self.origin = now
+			self.slot = 1
+			
+		else:
+			self.slot += due
+		
+		return count
+	
+	def resetStats(self):
+		self.bursts = 0
+		self.due_at = None
+		self.first_sent = None
+		self.first_sentences = 0
+		self.interval_count = 0
+		self.interval_max = 0.
+		self.interval_mean = 0.
+		self.interval_min = 0.
+		self.interval_m2 = 0.
+		self.last_sent = None
+		self.late_max = 0.
+		self.late_total = 0.
+		self.missed = 0
+		self.sent_count = 0
+		self.sentences = 0
+	
+	def sent(self, timestamp, count = 1):
+		if self.due_at is not None:
+			late = max(0., timestamp - self.due_at)
+			
+			self.late_max = max(self.late_max, late)
+			self.late_total += late
+			self.sent_count += 1
+			self.due_at = None
+		
+		self.sentences += count
+		
+		if self.last_sent is not None:
+			# Welford's running mean and variance of the interval
+			interval = timestamp - self.last_sent
+			
+			if self.interval_count == 0:
+				self.interval_max = interval
+				self.interval_min = interval
+				
+			else:
+				self.interval_max = max(self.interval_max, interval)
+				self.interval_min = min(self.interval_min, interval)
+			
+			self.interval_count += 1
+			
+			delta = interval - self.interval_mean
+			self.interval_mean += delta / self.interval_count
+			self.interval_m2 += delta * (interval - self.interval_mean)
+			
+		else:
+			self.first_sent = timestamp
+			self.first_sentences = self.sentences
+		
+		self.last_sent = timestamp
+	
+	def setPeriod(self, period, batch = 1):
+		# The new period starts from the pending deadline so there's no gap or burst
+		self.origin = self.deadline()
+		self.period = period
+		self.batch = max(1, batch)
+		self.slot = 0
+		
+		self.resetStats()
+	
+	def stats(self):
+		# All times are in milliseconds, rates in Hz
+		rate = 0.
+		stddev = 0.
+		
+		if self.interval_count > 1:
+			stddev = (self.interval_m2 / (self.interval_count - 1)) ** 0.5
+		
+		if self.interval_count > 0 and self.last_sent > self.first_sent:
+			# The sentences from the first send aren't part of any interval
+			rate = (self.sentences - self.first_sentences) / (self.last_sent - self.first_sent)
+		
+		return {"period": self.period * self.batch * 1000., "sent": self.sent_count, "sentences": self.sentences, "missed": self.missed, "bursts": self.bursts, "rate": rate, "requested": 1. / self.period, "late_mean": self.late_total / max(self.sent_count, 1) * 1000., "late_max": self.late_max * 1000., "interval_mean": self.interval_mean * 1000., "interval_stddev": stddev * 1000., "interval_min": self.interval_min * 1000., "interval_max": self.interval_max * 1000.}
+
+class StormCell():
+	# One thunderstorm cell, x/y are miles east/north of the station and the
+	# velocity is in miles an hour.  The strike rate builds up over the first
+	# 30% of its life, holds for the next 30% then dies away.
+	__slots__ = ["age", "alive", "lifetime", "peak", "radius", "vx", "vy", "x", "y"]
+	
+	def __init__(self):
+		self.age = 0.
+		self.alive = False
+		self.lifetime = 0.
+		self.peak = 0.
+		self.radius = 0.
+		self.vx = 0.
+		self.vy = 0.
+		self.x = 0.
+		self.y = 0.
+	
+	def bearing(self):
+		return math.degrees(math.atan2(self.x, self.y)) % 360.
+	
+	def distance(self):
+		return math.hypot(self.x, self.y)
+	
+	def rate(self):
+		# Strikes per minute at the cell's current age
+		f = self.age / self.lifetime
+		
+		if f < 0.3:
+			return self.peak * f / 0.3
+			
+		elif f < 0.6:
+			return self.peak
+			
+		else:
+			return self.peak * max(1. - f, 0.) / 0.4
+	
+	def stage(self):
+		f = self.age / self.lifetime
+		
+		if f < 0.3:
+			return "growing"
+			
+		elif f < 0.6:
+			return "mature"
+			
+		else:
+			return "decaying"
+
+class StormModel():
+	# Storm cells drifting across the area around the station.  A new cell is
+	# spawned on average every spawn_interval seconds (while there's a free
+	# slot) somewhere within STORM_RANGE + 100 miles, heading in a random
+	# direction, and lives for a random lifetime.  Each step() moves the
+	# cells on and draws the number of strikes from each one from a Poisson
+	# distribution of its current rate, scattered around the cell centre by
+	# its radius.  Only strikes within STORM_RANGE miles (the LD-250's range)
+	# are returned as (distance, bearing) pairs.
+	#
+	# The cells are a fixed pool reused as they die and the strike list is
+	# cleared and refilled each step, so a busy storm doesn't churn through
+	# allocations.  The list returned by step() is only valid until the next
+	# call.
+	def __init__(self, cells = 8, spawn_interval = STORM_SPAWN_INTERVAL, seed = None):
+		self.cells = [StormCell() for i in range(0, max(1, cells))]
+		self.last = None
+		self.next_spawn = None
+		self.random = random.Random(seed)
+		self.spawn_interval = spawn_interval
+		self.strike_callback = None
+		self.strikes = []
+		
+		# Start part way through, half the cells already going at random ages
+		for cell in self.cells[:(len(self.cells) + 1) / 2]:
+			self.spawn(cell)
+			
+			cell.age = self.random.uniform(0., cell.lifetime * 0.8)
+	
+	def active(self):
+		return [cell for cell in self.cells if cell.alive]
+	
+	def poisson(self, mean):
+		if mean <= 0.:
+			return 0
+		
+		if mean > 30.:
+			# Near enough normal by now and much cheaper
+			return max(0, int(round(self.random.gauss(mean, math.sqrt(mean)))))
+		
+		
+		# Knuth's method
+		limit = math.exp(-mean)
+		count = 0
+		product = self.random.random()
+		
+		while product > limit:
+			count += 1
+			product *= self.random.random()
+		
+		return count
+	
+	def rate(self):
+		# Strikes per minute from all the cells, in range or not
+		total = 0.
+		
+		for cell in self.cells:
+			if cell.alive:
+				total += cell.rate()
+		
+		return total
+	
+	def spawn(self, cell):
+		distance = self.random.uniform(0., STORM_RANGE + 100.)
+		direction = self.random.uniform(0., 2. * math.pi)
+		heading = self.random.uniform(0., 2. * math.pi)
+		speed = self.random.uniform(STORM_SPEED[0], STORM_SPEED[1])
+		
+		cell.age = 0.
+		cell.alive = True
+		cell.lifetime = self.random.uniform(STORM_LIFETIME[0], STORM_LIFETIME[1])
+		cell.peak = self.random.uniform(STORM_PEAK_RATE[0], STORM_PEAK_RATE[1])
+		cell.radius = STORM_CELL_RADIUS * self.random.uniform(0.5, 2.)
+		cell.vx = speed * math.sin(heading)
+		cell.vy = speed * math.cos(heading)
+		cell.x = distance * math.sin(direction)
+		cell.y = distance * math.cos(direction)
+	
+	def step(self, now):
+		# Returns the (distance, bearing) of the strikes since the last step
+		strikes = self.strikes
+		
+		del strikes[:]
+		
+		if self.last is None:
+			self.last = now
+			self.next_spawn = now + self.random.expovariate(1. / self.spawn_interval)
+			
+			return strikes
+		
+		
+		elapsed = now - self.last
+		self.last = now
+		
+		if elapsed <= 0.:
+			return strikes
+		
+		
+		gauss = self.random.gauss
+		
+		for cell in self.cells:
+			if not cell.alive:
+				continue
+			
+			cell.age += elapsed
+			cell.x += cell.vx * elapsed / 3600.
+			cell.y += cell.vy * elapsed / 3600.
+			
+			if cell.age >= cell.lifetime:
+				cell.alive = False
+				
+				continue
+			
+			
+			for i in range(0, self.poisson(cell.rate() * elapsed / 60.)):
+				x = cell.x + gauss(0., cell.radius)
+				y = cell.y + gauss(0., cell.radius)
+				distance = math.hypot(x, y)
+				
+				if distance <= STORM_RANGE:
+					strikes.append((int(distance), round(math.degrees(math.atan2(x, y)) % 360., 1) % 360.))
+		
+		while now >= self.next_spawn:
+			for cell in self.cells:
+				if not cell.alive:
+					self.spawn(cell)
+					
+					break
+			
+			self.next_spawn += self.random.expovariate(1. / self.spawn_interval)
+		
+		if self.strike_callback is not None and len(strikes) > 0:
+			# Anything else the storm drives (see FieldModel)
+			self.strike_callback(strikes, now)
+		
+		return strikes
+
+class StrikeCounter():
+	# Rolling count of the strikes over the last window seconds, kept in
+	# one-second buckets in a ring so it costs the same however busy it gets.
+	def __init__(self, window = STRIKE_RATE_WINDOW):
+		self.buckets = [0] * window
+		self.current = None
+		self.total = 0
+		self.window = window
+	
+	def add(self, count, now):
+		self.advance(now)
+		
+		self.buckets[self.current % self.window] += count
+		self.total += count
+	
+	def advance(self, now):
+		second = int(now)
+		
+		if self.current is None:
+			self.current = second
+			
+		elif second > self.current:
+			# Empty the buckets we've moved past
+			for i in range(1, min(second - self.current, self.window) + 1):
+				index = (self.current + i) % self.window
+				
+				self.total -= self.buckets[index]
+				self.buckets[index] = 0
+			
+			self.current = second
+	
+	def count(self, now):
+		self.advance(now)
+		
+		return self.total
+
+class StrikeGenerator():
+	# A seeded stream of random (distance, bearing) strikes, the same seed
+	# always gives the same strikes so a run can be repeated exactly.  The
+	# distance and bearing are each drawn from a distribution - uniform
+	# covers mean +/- spread, normal has spread as its standard deviation.
+	# Distances are whole miles 0-300 and bearings are to 0.1 degree.
+	#
+	# With NumPy installed (and vectorise on) a batch is drawn in one go,
+	# its stream differs from the pure Python one so the same seed only
+	# repeats on the same backend.
+	def __init__(self, seed = None, distance_distribution = DISTRIBUTION_UNIFORM, distance_mean = 150., distance_spread = 150., bearing_distribution = DISTRIBUTION_UNIFORM, bearing_mean = 180., bearing_spread = 180., vectorise = True):
+		for distribution in [distance_distribution, bearing_distribution]:
+			if distribution not in DISTRIBUTIONS:
+				raise ValueError("Distribution \"%s\" isn't known." % distribution)
+		
+		
+		self.bearing = (bearing_distribution, bearing_mean, bearing_spread)
+		self.distance = (distance_distribution, distance_mean, distance_spread)
+		self.numpy = None
+		self.random = None
+		self.seed = seed
+		
+		if vectorise and _numpy is not None:
+			self.numpy = _numpy.random.RandomState(seed)
+			
+		else:
+			self.random = random.Random(seed)
+	
+	def drawArgs(self, distribution, extra):
+		# Arguments for the draw.  Distances are floor()ed, so a uniform range
+		# gets an extra mile on top to reach it and a normal one is shifted by
+		# half a mile so it rounds.
+		kind, mean, spread = distribution
+		
+		if kind == DISTRIBUTION_UNIFORM:
+			return (mean - spread, mean + spread + extra)
+		
+		return (mean + extra / 2., spread)
+	
+	def strikes(self, count = 1):
+		# Returns a list of count (distance, bearing) pairs
+		if count <= 0:
+			return []
+		
+		if self.numpy is not None:
+			return self.strikesNumPy(count)
+		
+		
+		draw = {DISTRIBUTION_NORMAL: self.random.gauss, DISTRIBUTION_UNIFORM: self.random.uniform}
+		
+		distance_draw = draw[self.distance[0]]
+		distance_a, distance_b = self.drawArgs(self.distance, 1.)
+		bearing_draw = draw[self.bearing[0]]
+		bearing_a, bearing_b = self.drawArgs(self.bearing, 0.)
+		
+		strikes = []
+		append = strikes.append
+		
+		for i in xrange(0, count):
+			distance = min(max(int(math.floor(distance_draw(distance_a, distance_b))), 0), 300)
+			tenths = int(round(bearing_draw(bearing_a, bearing_b) * 10.)) % 3600
+			
+			append((distance, tenths / 10.))
+		
+		return strikes
+	
+	def strikesNumPy(self, count):
+		np = _numpy
+		
+		draw = {DISTRIBUTION_NORMAL: self.numpy.normal, DISTRIBUTION_UNIFORM: self.numpy.uniform}
+		
+		distance_a, distance_b = self.drawArgs(self.distance, 1.)
+		distances = np.clip(np.floor(draw[self.distance[0]](distance_a, distance_b, count)), 0, 300).astype(int)
+		
+		bearing_a, bearing_b = self.drawArgs(self.bearing, 0.)
+		tenths = np.mod(np.rint(draw[self.bearing[0]](bearing_a, bearing_b, count) * 10.).astype(int), 3600)
+		
+		return zip(distances.tolist(), (tenths / 10.).tolist())
+
+class TCPClient():
+	def __init__(self, sock, address):
+		self.address = address
+		self.closing = False
+		self.dropped = 0
+		self.offset = 0
+		self.pending = deque()
+		self.queued = 0
+		self.sock = sock
+
+class TCPPort():
+	# Listens on a TCP port and looks like serial.Serial to the emulator.
+	# Every sentence is written once and the same string is queued for each
+	# connected client, anything a client sends is fed into the receive side
+	# so squelch commands work from any of them.  A client which can't keep
+	# up has at most max_buffer bytes queued (or a single write if that is
+	# bigger), after that writes to it are dropped or it is disconnected
+	# depending on overflow_policy.
+	def __init__(self, address, max_buffer = TCP_BUFFER, overflow_policy = TCP_OVERFLOW_DROP, timeout = None):
+		if overflow_policy not in TCP_OVERFLOW_POLICIES:
+			raise ValueError("Unknown TCP overflow policy \"%s\"." % overflow_policy)
+		
+		
+		self.address = address
+		self.clients = {}
+		self.connections = 0
+		self.disconnections = 0
+		self.dropped = 0
+		self.iothread = None
+		self.iothread_alive = False
+		self.listener = None
+		self.lock = threading.Lock()
+		self.max_buffer = max_buffer
+		self.name = None
+		self.overflow_policy = overflow_policy
+		self.rxbuffer = bytearray()
+		self.rxpipe_r = None
+		self.rxpipe_w = None
+		self.rxsignalled = False
+		self.timeout = timeout
+		self.wakepipe_r = None
+		self.wakepipe_w = None
+		self.wakesignalled = False
+	
+	def close(self):
+		self.iothread_alive = False
+		
+		if self.wakepipe_w is not None:
+			os.write(self.wakepipe_w, "\x00")
+		
+		if self.iothread is not None:
+			self.iothread.join(1.)
+			self.iothread = None
+		
+		with self.lock:
+			for client in self.clients.values():
+				client.sock.close()
+			
+			self.clients = {}
+		
+		if self.listener is not None:
+			self.listener.close()
+			self.listener = None
+		
+		# Wake up anything blocked in read()
+		if self.rxpipe_w is not None:
+			os.write(self.rxpipe_w, "\x00")
+		
+		for fd in [self.rxpipe_r, self.rxpipe_w, self.wakepipe_r, self.wakepipe_w]:
+			if fd is not None:
+				os.close(fd)
+		
+		self.rxpipe_r = self.rxpipe_w = self.wakepipe_r = self.wakepipe_w = None
+	
+	def closeClient(self, client):
+		# Caller must hold the lock
+		if client.sock in self.clients:
+			del self.clients[client.sock]
+			
+			self.disconnections += 1
+		
+		try:
+			client.sock.close()
+			
+		except socket.error:
+			pass
+	
+	def fileno(self):
+		return self.rxpipe_r
+	
+	def flush(self):
+		pass
+	
+	def inWaiting(self):
+		return len(self.rxbuffer)
+	
+	def ioThread(self):
+		while self.iothread_alive:
+			with self.lock:
+				socks = self.clients.keys()
+				writers = [c.sock for c in self.clients.values() if c.queued > 0]
+			
+			try:
+				r, w, x = select.select([self.listener, self.wakepipe_r] + socks, writers, [])
+				
+			except (select.error, socket.error):
+				# A client was closed underneath us, go round again
+				continue
+			
+			if not self.iothread_alive:
+				break
+			
+			
+			with self.lock:
+				if self.wakepipe_r in r:
+					os.read(self.wakepipe_r, 4096)
+					
+					self.wakesignalled = False
+				
+				if self.listener in r:
+					try:
+						sock, address = self.listener.accept()
+						sock.setblocking(0)
+						
+						self.clients[sock] = TCPClient(sock, address)
+						self.connections += 1
+						
+					except socket.error:
+						pass
+				
+				for sock in r:
+					client = self.clients.get(sock)
+					
+					if client is None:
+						continue
+					
+					try:
+						data = sock.recv(4096)
+						
+					except socket.error:
+						data = ""
+					
+					if len(data) == 0:
+						self.closeClient(client)
+						
+					else:
+						self.rxbuffer.extend(data)
+						
+						if not self.rxsignalled:
+							self.rxsignalled = True
+							
+							os.write(self.rxpipe_w, "\x00")
+				
+				for sock in w:
+					client = self.clients.get(sock)
+					
+					if client is None:
+						continue
+					
+					# Coalesce whatever is pending into one send
+					if len(client.pending) > 1:
+						data = "".join(client.pending)[client.offset:]
+						
+						client.pending.clear()
+						client.pending.append(data)
+						client.offset = 0
+					
+					try:
+						sent = sock.send(client.pending[0][client.offset:])
+						
+					except socket.error:
+						self.closeClient(client)
+						continue
+					
+					client.offset += sent
+					client.queued -= sent
+					
+					if client.offset >= len(client.pending[0]):
+						client.pending.popleft()
+						client.offset = 0
+				
+				for client in self.clients.values():
+					if client.closing:
+						self.closeClient(client)
+	
+	def open(self):
+		host, port = "", self.address
+		
+		if ":" in port:
+			host, port = port.rsplit(":", 1)
+		
+		
+		self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.listener.bind((host, int(port)))
+		self.listener.listen(16)
+		self.listener.setblocking(0)
+		
+		host, port = self.listener.getsockname()
+		self.name = "%s:%s:%d" % (TCP_PREFIX, host, port)
+		
+		self.rxpipe_r, self.rxpipe_w = os.pipe()
+		self.wakepipe_r, self.wakepipe_w = os.pipe()
+		
+		
+		self.iothread_alive = True
+		
+		self.iothread = threading.Thread(target = self.ioThread)
+		self.iothread.setDaemon(1)
+		self.iothread.start()
+	
+	def read(self, size = 1):
+		if len(self.rxbuffer) == 0:
+			r, w, x = select.select([self.rxpipe_r], [], [], self.timeout)
+		
+		if self.rxpipe_r is None:
+			return ""
+		
+		
+		with self.lock:
+			data = str(self.rxbuffer[:size])
+			
+			del self.rxbuffer[:size]
+			
+			if len(self.rxbuffer) == 0 and self.rxsignalled:
+				self.rxsignalled = False
+				
+				os.read(self.rxpipe_r, 1)
+		
+		return data
+	
+	def write(self, data):
+		# The same string is queued for every client, nothing is re-encoded
+		data = str(data)
+		
+		with self.lock:
+			for client in self.clients.values():
+				if client.queued > 0 and client.queued + len(data) > self.max_buffer:
+					client.dropped += 1
+					self.dropped += 1
+					
+					if self.overflow_policy == TCP_OVERFLOW_DISCONNECT:
+						client.closing = True
+					
+					continue
+				
+				client.pending.append(data)
+				client.queued += len(data)
+			
+			if not self.wakesignalled:
+				self.wakesignalled = True
+				
+				os.write(self.wakepipe_w, "\x00")
+		
+		return len(data)
+
+
+
+class VirtualClock():
+	# Emulated time, starting at start (default now).  With a speed of 0 time
+	# only moves when something sleeps or waits on the clock, so the output
+	# is generated as fast as it can be written.  Any other speed runs the
+	# clock that many times faster than real time.  Once duration seconds of
+	# emulated time have passed expired() is true and the units stop.
+	#
+	# With a speed of 0 each thread sleeping on the clock pushes it forward
+	# to its own deadline, units sharing one clock should be driven from a
+	# single thread (FleetHost) so their output stays in step.
+	def __init__(self, start = None, speed = 0., duration = None):
+		if start is None:
+			start = time.time()
+		
+		
+		self.duration = duration
+		self.elapsed = 0.
+		self.lock = threading.Lock()
+		self.origin = start
+		self.real_origin = monotonic()
+		self.speed = float(speed)
+	
+	def advanceTo(self, elapsed):
+		# Moves the clock on to the given monotonic time, never backwards
+		with self.lock:
+			if elapsed > self.elapsed:
+				self.elapsed = elapsed
+	
+	def expired(self):
+		return self.duration is not None and self.monotonic() >= self.duration
+	
+	def monotonic(self):
+		if self.speed > 0.:
+			return (monotonic() - self.real_origin) * self.speed
+		
+		return self.elapsed
+	
+	def sleep(self, seconds):
+		if self.speed > 0.:
+			time.sleep(seconds / self.speed)
+			
+		else:
+			self.advanceTo(self.elapsed + seconds)
+	
+	def time(self):
+		return self.origin + self.monotonic()
+	
+	def wait(self, waiter, timeout):
+		if self.speed > 0.:
+			return waiter.wait(timeout / self.speed)
+		
+		if waiter.wait(0.):
+			return True
+		
+		self.sleep(timeout)
+		
+		return False
+	
+	def waitUntil(self, waiter, deadline, spin = 0.):
+		# Emulated time is always on time, so there's nothing to spin for
+		timeout = deadline - self.monotonic()
+		
+		if timeout <= 0.:
+			return waiter.wait(0.)
+		
+		return self.wait(waiter, timeout)
+
+
+class Waker():
+	# Something a thread can sleep on with a deadline and another thread can
+	# wake it from, through a pipe on POSIX so it can also go in a poll() set.
+	def __init__(self):
+		self.event = None
+		self.lock = threading.Lock()
+		self.pipe_r = None
+		self.pipe_w = None
+		self.signalled = False
+		
+		if sys.platform.lower() == "win32":
+			self.event = threading.Event()
+			
+		else:
+			self.pipe_r, self.pipe_w = os.pipe()
+	
+	def clear(self):
+		with self.lock:
+			if self.signalled:
+				self.signalled = False
+				
+				if self.event is not None:
+					self.event.clear()
+					
+				elif self.pipe_r is not None:
+					os.read(self.pipe_r, 1)
+	
+	def close(self):
+		with self.lock:
+			if self.pipe_r is not None:
+				os.close(self.pipe_r)
+				os.close(self.pipe_w)
+				
+				self.pipe_r = None
+				self.pipe_w = None
+	
+	def fileno(self):
+		return self.pipe_r
+	
+	def wait(self, timeout):
+		if self.signalled:
+			return True
+		
+		if self.event is not None:
+			return self.event.wait(timeout)
+		
+		
+		r, w, x = select.select([self.pipe_r], [], [], timeout)
+		
+		return len(r) > 0
+	
+	def wake(self):
+		with self.lock:
+			if not self.signalled:
+				self.signalled = True
+				
+				if self.event is not None:
+					self.event.set()
+					
+				elif self.pipe_w is not None:
+					os.write(self.pipe_w, "\x00")
+
+
+###############
+# Subroutines #
+###############
+def formatIngest(stats):
+	return "%d row(s) from %d file(s) at %.0f rows/s (%.2fMB/s), %d in range, %d sent at %.0f strikes/s, %d unreadable, %d out of order, %.1fs" % (stats["rows"], stats["files"], stats["rows_rate"], stats["byte_rate"] / 1048576., stats["in_range"], stats["sent"], stats["sent_rate"], stats["errors"], stats["out_of_order"], stats["elapsed"])
+
+def formatJitter(stats):
+	return "%d sentence(s) at %.2fHz of %.2fHz requested, %d write(s) every %.1fms, interval %.3fms mean %.3fms stddev (%.3f-%.3fms), lateness %.3fms mean %.3fms max, %d missed, %d bursts" % (stats["sentences"], stats["rate"], stats["requested"], stats["sent"], stats["period"], stats["interval_mean"], stats["interval_stddev"], stats["interval_min"], stats["interval_max"], stats["late_mean"], stats["late_max"], stats["missed"], stats["bursts"])
+
+def formatLine(stats):
+	return "%.0f bytes/s line, %.1f%% utilised, %d byte(s) sent, %.0f byte(s) backlog, deferred %d time(s), %d sentence(s) dropped" % (stats["capacity"], stats["utilisation"], stats["bytes"], stats["backlog"], stats["deferred"], stats["dropped"])
+
+def formatOutput(stats):
+	return "%d sentence(s) in %d write(s), %d handoff(s) at %.3fms mean %.3fms max, %d held back for the line, lock contended %d time(s)" % (stats["sentences"], stats["batches"], stats["handoffs"], stats["handoff_mean"], stats["handoff_max"], stats["held"], stats["contended"])
+
+def monotonic():
+	return _monotonic()
+
+def newClock(speed = 1., duration = 0.):
+	# Speed 1 is real time, 0 as fast as possible and anything else accelerated, a duration of 0 runs forever
+	if speed == 1. and duration <= 0.:
+		return RealClock()
+	
+	if duration <= 0.:
+		duration = None
+	
+	return VirtualClock(None, speed, duration)
+
+def newSeed(seed = None):
+	# A seed of 0 or None picks one at random, return it so it can be logged and the run repeated
+	if seed:
+		return int(seed)
+	
+	return struct.unpack("<I", os.urandom(4))[0]
+
+def readRecording(path):
+	# Yields (monotonic microseconds, wall clock time, sentence) for each record in a SentenceRecorder file
+	f = open(path, "rb")
+	
+	try:
+		if f.read(len(RECORD_MAGIC)) <> RECORD_MAGIC:
+			raise ValueError("%s isn't a recording." % path)
+		
+		header = struct.calcsize(RECORD_BLOCK_HEADER)
+		
+		while True:
+			data = f.read(header)
+			
+			if len(data) < header:
+				break
+			
+			flags, raw_length, stored_length, us, wall = struct.unpack(RECORD_BLOCK_HEADER, data)
+			
+			block = f.read(stored_length)
+			
+			if len(block) < stored_length:
+				# Truncated by a crash mid-write, everything before it is still good
+				break
+			
+			if flags & RECORD_COMPRESSED:
+				block = zlib.decompress(block)
+			
+			block = bytearray(block)
+			base = us
+			x = 0
+			
+			while x < len(block):
+				values = []
+				
+				for i in range(2):
+					value = 0
+					shift = 0
+					
+					while True:
+						b = block[x]
+						x += 1
+						
+						value |= (b & 0x7f) << shift
+						shift += 7
+						
+						if b < 0x80:
+							break
+					
+					values.append(value)
+				
+				us += values[0]
+				
+				yield (us, wall + (us - base) / 1000000., str(block[x:x + values[1]]))
+				
+				x += values[1]
+		
+	finally:
+		f.close()
+
+def setupMonotonic():
+	# Python 2 has no time.monotonic() so go straight to clock_gettime() where we can
+	try:
+		import ctypes
+		import ctypes.util
+		
+		
+		class timespec(ctypes.Structure):
+			_fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+		
+		
+		if sys.platform.startswith("linux"):
+			clock = 1 # CLOCK_MONOTONIC
+			
+		elif sys.platform.startswith("freebsd"):
+			clock = 4 # CLOCK_MONOTONIC
+			
+		else:
+			return time.time
+		
+		librt = ctypes.CDLL(ctypes.util.find_library("rt") or ctypes.util.find_library("c"), use_errno = True)
+		clock_gettime = librt.clock_gettime
+		clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+		
+		def monotonicClock():
+			ts = timespec()
+			
+			if clock_gettime(clock, ctypes.byref(ts)) <> 0:
+				raise OSError(ctypes.get_errno(), "clock_gettime() failed.")
+			
+			return ts.tv_sec + ts.tv_nsec / 1000000000.
+		
+		
+		monotonicClock()
+		
+		return monotonicClock
+		
+	except Exception:
+		return time.time
+
+
+def setupNumPy():
+	# NumPy is optional, used to draw random strikes and project geographic ones in bulk (StrikeGenerator, GeoProjector)
+	try:
+		import numpy
+		
+		return numpy
+		
+	except ImportError:
+		return None
+
+
+_monotonic = setupMonotonic()
+_numpy = setupNumPy()
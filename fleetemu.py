@@ -0,0 +1,807 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#########################################################################
+# Copyright/License Notice (BSD License)                                #
+#########################################################################
+#########################################################################
+# Copyright (c) 2011, Daniel Knaggs                                     #
+# All rights reserved.                                                  #
+#                                                                       #
+# Redistribution and use in source and binary forms, with or without    #
+# modification, are permitted provided that the following conditions    #
+# are met: -                                                            #
+#                                                                       #
+#   * Redistributions of source code must retain the above copyright    #
+#     notice, this list of conditions and the following disclaimer.     #
+#                                                                       #
+#   * Redistributions in binary form must reproduce the above copyright #
+#     notice, this list of conditions and the following disclaimer in   #
+#     the documentation and/or other materials provided with the        #
+#     distribution.                                                     #
+#                                                                       #
+#   * Neither the name of the author nor the names of its contributors  #
+#     may be used to endorse or promote products derived from this      #
+#     software without specific prior written permission.               #
+#                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS   #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT     #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR #
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT  #
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, #
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT      #
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, #
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY #
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT   #
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  #
+#########################################################################
+
+
+
+###################################################
+# Boltek Emulator Fleet Host                      #
+###################################################
+# Version:     v0.1.2                             #
+###################################################
+
+
+from datetime import *
+from efm100emu import EFM100Emu
+from emucommon import *
+import heapq
+from ld250emu import LD250Emu, QUEUE_BLOCK, QUEUE_SIZE
+import multiprocessing
+import os
+import Queue
+import resource
+import select
+import signal
+import sys
+import threading
+import time
+from xml.dom import minidom
+
+
+###########
+# Globals #
+###########
+fleet = None
+
+
+#############
+# Constants #
+#############
+DEBUG_MODE = False
+
+FLEET_REPORT_INTERVAL = 10.
+FLEET_CLOCK_SPEED = 1.
+FLEET_RESTART_DELAY = 1.
+FLEET_RUN_FOR = 0.
+FLEET_UNITS = []
+FLEET_WORKERS = 0
+
+UNIT_EFM100 = "EFM100"
+UNIT_LD250 = "LD250"
+
+XML_SETTINGS_FILE = "fleetemu-settings.xml"
+
+
+###########
+# Classes #
+###########
+class FleetHost():
+	# Drives any number of LD-250 and EFM-100 units from one thread.  Each
+	# unit is created with autostart = False so it has no threads of its own,
+	# instead we poll() on every port and LD-250 transmit queue and keep a
+	# heap of the time each unit next needs servicing.  The thread sleeps in
+	# the kernel until one of those happens so an idle fleet costs nothing.
+	#
+	# Pseudo-terminals are switched to non-blocking so a consumer which has
+	# stopped reading can't stall the rest of the fleet.  TCP ports still use
+	# their own I/O thread, serial ports are written to as normal.
+	def __init__(self, debug_mode = False, clock = None):
+		self.alive = False
+		self.clock = clock or RealClock()
+		self.deadlines = {}
+		self.last_report = None
+		self.poller = None
+		self.readers = {}
+		self.report_callback = None
+		self.services = 0
+		self.timers = []
+		self.units = []
+		self.wakeups = 0
+		self.writers = {}
+		
+		self.DEBUG_MODE = debug_mode
+		
+		
+		self.poller = select.poll()
+	
+	def addUnit(self, unit):
+		if self.DEBUG_MODE:
+			self.log("addUnit", "Information", "Running...")
+		
+		
+		port = unit.serial
+		
+		if hasattr(port, "setNonBlocking"):
+			port.setNonBlocking()
+		
+		self.units.append(unit)
+		
+		index = len(self.units)
+		
+		if port.fileno() is not None:
+			self.readers[port.fileno()] = (index, unit)
+			self.poller.register(port.fileno(), select.POLLIN)
+		
+		# Woken when sentences are queued (LD-250) or handed over to the output
+		self.readers[unit.output.waker.fileno()] = (index, unit)
+		self.poller.register(unit.output.waker.fileno(), select.POLLIN)
+		
+		self.deadlines[index] = unit.next_status
+		
+		heapq.heappush(self.timers, (unit.next_status, index, unit))
+	
+	def dispose(self):
+		if self.DEBUG_MODE:
+			self.log("dispose", "Information", "Running...")
+		
+		
+		self.alive = False
+		
+		for unit in self.units:
+			unit.dispose()
+		
+		self.units = []
+	
+	def log(self, module, level, message):
+		print "FLEETEMU/%s()/%s - %s" % (module, level, message)
+	
+	def report(self):
+		stats = self.stats()
+		
+		if self.report_callback is not None:
+			self.report_callback(stats)
+			
+		elif self.last_report is not None:
+			self.log("report", "Information", formatStats(stats, self.last_report))
+		
+		self.last_report = stats
+	
+	def reschedule(self, index, unit, deadline):
+		# Brings a unit's timer forward when servicing it out of turn wants it back sooner
+		if deadline < self.deadlines[index]:
+			self.deadlines[index] = deadline
+			
+			heapq.heappush(self.timers, (deadline, index, unit))
+	
+	def run(self, report_interval = None):
+		if self.DEBUG_MODE:
+			self.log("run", "Information", "Running...")
+		
+		
+		self.alive = True
+		
+		next_report = None
+		
+		# This thread does all the writing from now on
+		for unit in self.units:
+			unit.output.claim()
+		
+		if report_interval is not None:
+			self.report()
+			
+			next_report = time.time() + report_interval
+		
+		while self.alive:
+			deadline = None
+			
+			if len(self.timers) > 0:
+				deadline = self.timers[0][0]
+			
+			if deadline is None:
+				# No units (an empty shard), nothing to do but check now and again whether we've been stopped
+				timeout = 1000
+				
+			elif self.clock.speed > 0.:
+				timeout = max(0, int((deadline - self.clock.monotonic()) / self.clock.speed * 1000.) + 1)
+				
+			elif len(self.writers) > 0:
+				# Emulated time, let the consumers catch up before moving on
+				timeout = 1000
+				
+			else:
+				# Emulated time, just pick up any I/O then jump straight to the next deadline
+				timeout = 0
+			
+			if next_report is not None:
+				timeout = min(timeout, max(0, int((next_report - time.time()) * 1000.) + 1))
+			
+			try:
+				events = self.poller.poll(timeout)
+				
+			except select.error:
+				# Interrupted by a signal
+				continue
+			
+			if len(events) == 0 and len(self.writers) == 0 and self.clock.speed == 0. and deadline is not None:
+				self.clock.advanceTo(deadline)
+			
+			if self.clock.expired():
+				self.log("run", "Information", "The run has finished.")
+				
+				break
+			
+			self.wakeups += 1
+			
+			
+			for fd, event in events:
+				index, unit = self.readers.get(fd, (None, None))
+				
+				if unit is not None and event & (select.POLLIN | select.POLLHUP | select.POLLERR):
+					if fd == unit.serial.fileno():
+						self.serviceInput(unit)
+						
+					else:
+						self.reschedule(index, unit, self.serviceUnit(unit))
+				
+				if event & select.POLLOUT and fd in self.writers:
+					self.writers[fd].writePending()
+			
+			
+			now = self.clock.monotonic()
+			
+			while len(self.timers) > 0 and self.timers[0][0] <= now:
+				deadline, index, unit = heapq.heappop(self.timers)
+				
+				if deadline <> self.deadlines[index]:
+					# Superseded by reschedule()
+					continue
+				
+				deadline = self.serviceUnit(unit, now)
+				
+				self.deadlines[index] = deadline
+				
+				heapq.heappush(self.timers, (deadline, index, unit))
+			
+			if next_report is not None and time.time() >= next_report:
+				self.report()
+				
+				next_report = time.time() + report_interval
+			
+			
+			# Only ask for POLLOUT on ports which have something held back
+			for port in self.writers.values():
+				if not port.wantsWrite():
+					del self.writers[port.fileno()]
+					
+					self.poller.modify(port.fileno(), select.POLLIN)
+	
+	def serviceInput(self, unit):
+		port = unit.serial
+		
+		try:
+			data = port.read(max(1, port.inWaiting()))
+			
+		except Exception, ex:
+			if self.DEBUG_MODE:
+				self.log("serviceInput", "Exception", str(ex))
+			
+			return
+		
+		if len(data) > 0 and isinstance(unit, LD250Emu):
+			unit.processInput(data)
+		
+		self.watchPort(port)
+	
+	def serviceUnit(self, unit, now = None):
+		if now is None:
+			now = self.clock.monotonic()
+		
+		self.services += 1
+		
+		try:
+			deadline = unit.service(now)
+			
+		except Exception, ex:
+			if self.DEBUG_MODE:
+				self.log("serviceUnit", "Exception", str(ex))
+			
+			deadline = now + 1.
+		
+		self.watchPort(unit.serial)
+		
+		return deadline
+	
+	def stats(self):
+		usage = resource.getrusage(resource.RUSAGE_SELF)
+		dropped = 0
+		late_max = 0.
+		missed = 0
+		sentences = 0
+		
+		for unit in self.units:
+			late_max = max(late_max, unit.schedule.late_max)
+			missed += unit.schedule.missed
+			sentences += unit.output.sentences
+			
+			if isinstance(unit, LD250Emu):
+				dropped += unit.txqueue.dropped
+		
+		return {"time": time.time(), "cpu": usage.ru_utime + usage.ru_stime, "rss": usage.ru_maxrss, "threads": threading.activeCount(), "units": len(self.units), "wakeups": self.wakeups, "services": self.services, "sentences": sentences, "late_max": late_max * 1000., "missed": missed, "dropped": dropped}
+	
+	def stop(self):
+		self.alive = False
+	
+	def watchPort(self, port):
+		if hasattr(port, "wantsWrite") and port.wantsWrite() and port.fileno() not in self.writers:
+			self.writers[port.fileno()] = port
+			
+			self.poller.modify(port.fileno(), select.POLLIN | select.POLLOUT)
+
+
+class FleetSupervisor():
+	# Shards the units over a pool of worker processes, each running its own
+	# FleetHost, so a large fleet isn't limited to what one interpreter (and
+	# its GIL) can drive.  Workers send their stats back over a queue every
+	# report interval and any worker which dies is restarted with the same
+	# units after FLEET_RESTART_DELAY seconds.
+	def __init__(self, units, workers = 0, report_interval = FLEET_REPORT_INTERVAL, debug_mode = False):
+		if workers <= 0:
+			workers = multiprocessing.cpu_count()
+		
+		workers = max(1, min(workers, len(units)))
+		
+		
+		self.alive = False
+		self.last_stats = {}
+		self.processes = [None] * workers
+		self.queue = multiprocessing.Queue()
+		self.report_interval = report_interval
+		self.restarts = 0
+		self.shards = []
+		self.stats = {}
+		self.stopped = [None] * workers
+		
+		self.DEBUG_MODE = debug_mode
+		
+		
+		for i in range(workers):
+			self.shards.append(units[i::workers])
+	
+	def dispose(self):
+		if self.DEBUG_MODE:
+			self.log("dispose", "Information", "Running...")
+		
+		
+		self.alive = False
+		
+		# Don't let a second CTRL+C leave the workers behind
+		signal.signal(signal.SIGINT, signal.SIG_IGN)
+		
+		for process in self.processes:
+			if process is not None and process.is_alive():
+				process.terminate()
+		
+		for process in self.processes:
+			if process is not None:
+				process.join(5.)
+	
+	def log(self, module, level, message):
+		print "FLEETEMU/%s()/%s - %s" % (module, level, message)
+	
+	def report(self):
+		totals = {}
+		last_totals = {}
+		
+		for index, stats in self.stats.items():
+			last = self.last_stats.get(index)
+			
+			# Only compare against the previous report from the same process
+			if last is None or last["pid"] <> stats["pid"]:
+				continue
+			
+			for key in ["cpu", "rss", "threads", "units", "wakeups", "services", "sentences", "missed", "dropped"]:
+				totals[key] = totals.get(key, 0) + stats[key]
+				last_totals[key] = last_totals.get(key, 0) + last[key]
+			
+			totals["late_max"] = max(totals.get("late_max", 0.), stats["late_max"])
+			totals["time"] = max(totals.get("time", 0), stats["time"])
+			last_totals["time"] = max(last_totals.get("time", 0), last["time"])
+		
+		if len(totals) > 0:
+			self.log("report", "Information", "%d/%d workers, %d restarts - %s" % (len([p for p in self.processes if p is not None and p.is_alive()]), len(self.processes), self.restarts, formatStats(totals, last_totals)))
+		
+		self.last_stats = dict(self.stats)
+	
+	def run(self):
+		if self.DEBUG_MODE:
+			self.log("run", "Information", "Running...")
+		
+		
+		self.alive = True
+		
+		for i in range(len(self.processes)):
+			self.startWorker(i)
+		
+		next_report = time.time() + self.report_interval
+		
+		while self.alive:
+			try:
+				index, stats = self.queue.get(True, 1.)
+				
+				# Anything still queued from a worker which has since been replaced is stale
+				process = self.processes[index]
+				
+				if process is not None and process.pid == stats["pid"]:
+					self.stats[index] = stats
+				
+			except Queue.Empty:
+				# Nothing has come in
+				pass
+				
+			except Exception, ex:
+				self.log("run", "Exception", str(ex))
+			
+			
+			now = time.time()
+			
+			for i, process in enumerate(self.processes):
+				if process.is_alive():
+					continue
+				
+				if self.stopped[i] is None:
+					self.log("run", "Warning", "Worker %d (PID %d) has exited with code %s, restarting it in %.1f seconds..." % (i, process.pid, process.exitcode, FLEET_RESTART_DELAY))
+					
+					self.stopped[i] = now
+					
+					# Its last stats would otherwise keep being reported as if it were still running
+					self.stats.pop(i, None)
+					self.last_stats.pop(i, None)
+					
+				elif now - self.stopped[i] >= FLEET_RESTART_DELAY:
+					self.restarts += 1
+					self.startWorker(i)
+			
+			if now >= next_report:
+				self.report()
+				
+				next_report = now + self.report_interval
+	
+	def startWorker(self, index):
+		if self.DEBUG_MODE:
+			self.log("startWorker", "Information", "Running...")
+		
+		
+		process = multiprocessing.Process(target = fleetWorker, args = (index, self.shards[index], self.queue, self.report_interval, self.DEBUG_MODE))
+		process.daemon = True
+		process.start()
+		
+		self.processes[index] = process
+		self.stopped[index] = None
+	
+	def stop(self):
+		self.alive = False
+
+
+
+###############
+# Subroutines #
+###############
+def cBool(value):
+	if DEBUG_MODE:
+		log("cBool", "Information", "Starting...")
+	
+	
+	if str(value).lower() == "false" or str(value) == "0":
+		return False
+		
+	elif str(value).lower() == "true" or str(value) == "1":
+		return True
+		
+	else:
+		return False
+
+def exitProgram():
+	if DEBUG_MODE:
+		log("exitProgram", "Information", "Starting...")
+	
+	
+	global fleet
+	
+	
+	if fleet is not None:
+		fleet.dispose()
+		fleet = None
+	
+	
+	sys.exit(0)
+
+def fleetWorker(index, units, queue, report_interval, debug_mode):
+	# Runs in its own process, the supervisor stops us with SIGTERM
+	host = FleetHost(debug_mode, newClock(FLEET_CLOCK_SPEED, FLEET_RUN_FOR))
+	
+	def stopHost(signum, frame):
+		host.stop()
+	
+	def sendStats(stats):
+		stats["pid"] = os.getpid()
+		
+		queue.put((index, stats))
+	
+	
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, stopHost)
+	
+	try:
+		for settings in units:
+			host.addUnit(newUnit(settings, host.clock, debug_mode))
+		
+		host.report_callback = sendStats
+		host.run(report_interval)
+		
+	finally:
+		host.dispose()
+
+def formatStats(stats, last):
+	elapsed = max(stats["time"] - last["time"], 0.001)
+	
+	return "%d units, %d threads, %.1f%% CPU, %.0f wakeups/s, %.0f services/s, %.0f sentences/s, %dKB max RSS, %.1fms worst status lateness, %d missed status slot(s), %d queue drop(s)." % (stats["units"], stats["threads"], 100. * (stats["cpu"] - last["cpu"]) / elapsed, (stats["wakeups"] - last["wakeups"]) / elapsed, (stats["services"] - last["services"]) / elapsed, (stats["sentences"] - last["sentences"]) / elapsed, stats["rss"], stats["late_max"], stats["missed"] - last["missed"], stats["dropped"] - last["dropped"])
+
+def log(module, level, message):
+	t = datetime.now()
+	
+	print "%s | EMU/%s()/%s - %s" % (str(t.strftime("%d/%m/%Y %H:%M:%S")), module, level, message)
+
+def main():
+	if DEBUG_MODE:
+		log("main", "Information", "Starting...")
+	
+	
+	global fleet
+	
+	
+	print """
+#########################################################################
+# Copyright/License Notice (BSD License)                                #
+#########################################################################
+#########################################################################
+# Copyright (c) 2011, Daniel Knaggs                                     #
+# All rights reserved.                                                  #
+#                                                                       #
+# Redistribution and use in source and binary forms, with or without    #
+# modification, are permitted provided that the following conditions    #
+# are met: -                                                            #
+#                                                                       #
+#   * Redistributions of source code must retain the above copyright    #
+#     notice, this list of conditions and the following disclaimer.     #
+#                                                                       #
+#   * Redistributions in binary form must reproduce the above copyright #
+#     notice, this list of conditions and the following disclaimer in   #
+#     the documentation and/or other materials provided with the        #
+#     distribution.                                                     #
+#                                                                       #
+#   * Neither the name of the author nor the names of its contributors  #
+#     may be used to endorse or promote products derived from this      #
+#     software without specific prior written permission.               #
+#                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS   #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT     #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR #
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT  #
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, #
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT      #
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, #
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY #
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT   #
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  #
+#########################################################################
+"""
+	log("main", "Information", "")
+	log("main", "Information", "Boltek Emulator Fleet Host")
+	log("main", "Information", "==========================")
+	log("main", "Information", "Checking settings...")
+	
+	
+	if not os.path.exists(XML_SETTINGS_FILE):
+		log("main", "Warning", "The XML settings file doesn't exist, create one...")
+		
+		xmlEMUSettingsWrite()
+		
+		
+		log("main", "Information", "The XML settings file has been created using the default settings.  Please edit it and restart the emulator once you're happy with the settings.")
+		
+		exitProgram()
+		
+	else:
+		log("main", "Information", "Reading XML settings...")
+		
+		xmlEMUSettingsRead()
+		
+		# This will ensure it will have any new settings in
+		if os.path.exists(XML_SETTINGS_FILE + ".bak"):
+			os.unlink(XML_SETTINGS_FILE + ".bak")
+			
+		os.rename(XML_SETTINGS_FILE, XML_SETTINGS_FILE + ".bak")
+		xmlEMUSettingsWrite()
+	
+	
+	
+	log("main", "Information", "Setting up %d units..." % len(FLEET_UNITS))
+	
+	if FLEET_WORKERS == 1:
+		fleet = FleetHost(DEBUG_MODE, newClock(FLEET_CLOCK_SPEED, FLEET_RUN_FOR))
+		
+		for settings in FLEET_UNITS:
+			fleet.addUnit(newUnit(settings, fleet.clock, DEBUG_MODE))
+		
+	else:
+		fleet = FleetSupervisor(FLEET_UNITS, FLEET_WORKERS, FLEET_REPORT_INTERVAL, DEBUG_MODE)
+		
+		log("main", "Information", "Sharding the units over %d worker processes..." % len(fleet.processes))
+	
+	
+	log("main", "Information", "Starting, press CTRL+C to quit...")
+	
+	try:
+		if isinstance(fleet, FleetHost):
+			fleet.run(FLEET_REPORT_INTERVAL)
+			
+		else:
+			fleet.run()
+		
+	except KeyboardInterrupt:
+		pass
+	
+	
+	log("main", "Information", "Exiting...")
+	exitProgram()
+
+def newUnit(settings, clock = None, debug_mode = False):
+	if DEBUG_MODE:
+		log("newUnit", "Information", "Starting...")
+	
+	
+	args = (settings["Port"], int(settings["Speed"]), int(settings["Bits"]), settings["Parity"], int(settings["StopBits"]), debug_mode, settings["FlushPolicy"], int(settings["TCPBuffer"]), settings["TCPOverflow"])
+	
+	if settings["Type"] == UNIT_LD250:
+		unit = LD250Emu(*args, autostart = False, clock = clock, catchup = settings["CatchUp"], pacing = cBool(settings["LinePacing"]), queue_size = int(settings["QueueSize"]), queue_policy = settings["QueuePolicy"], seed = int(settings["Seed"]))
+		
+		if settings["Latitude"] <> "" and settings["Longitude"] <> "":
+			unit.setStation(float(settings["Latitude"]), float(settings["Longitude"]))
+		
+		if int(settings["StormCells"]) > 0:
+			unit.setStorm(StormModel(int(settings["StormCells"]), seed = unit.seed + 2))
+		
+		return unit
+		
+	elif settings["Type"] == UNIT_EFM100:
+		return EFM100Emu(*args, autostart = False, clock = clock, catchup = settings["CatchUp"], rate = float(settings["Rate"]), pacing = cBool(settings["LinePacing"]))
+		
+	else:
+		raise ValueError("Unit type \"%s\" isn't known." % settings["Type"])
+
+def unitDefaults(unit_type, port):
+	return {"Type": unit_type, "Port": port, "Speed": "9600", "Bits": "8", "Parity": "N", "StopBits": "1", "FlushPolicy": FLUSH_NEVER, "TCPBuffer": str(TCP_BUFFER), "TCPOverflow": TCP_OVERFLOW_DROP, "CatchUp": CATCHUP_SKIP, "Rate": "10", "LinePacing": "False", "QueueSize": str(QUEUE_SIZE), "QueuePolicy": QUEUE_BLOCK, "StormCells": "0", "Seed": "0", "Latitude": "", "Longitude": ""}
+
+def xmlEMUSettingsRead():
+	global DEBUG_MODE, FLEET_CLOCK_SPEED, FLEET_REPORT_INTERVAL, FLEET_RUN_FOR, FLEET_UNITS, FLEET_WORKERS
+	
+	
+	if DEBUG_MODE:
+		log("xmlEMUSettingsRead", "Information", "Starting...")
+	
+	
+	if os.path.exists(XML_SETTINGS_FILE):
+		xmldoc = minidom.parse(XML_SETTINGS_FILE)
+		
+		myvars = xmldoc.getElementsByTagName("Setting")
+		
+		for var in myvars:
+			for key in var.attributes.keys():
+				val = str(var.attributes[key].value)
+				
+				# Now put the correct values to correct key
+				if key == "ReportInterval":
+					FLEET_REPORT_INTERVAL = float(val)
+					
+				elif key == "ClockSpeed":
+					FLEET_CLOCK_SPEED = float(val)
+					
+				elif key == "RunFor":
+					FLEET_RUN_FOR = float(val)
+					
+				elif key == "Workers":
+					FLEET_WORKERS = int(val)
+					
+				elif key == "DebugMode":
+					DEBUG_MODE = cBool(val)
+					
+				else:
+					log("xmlEMUSettingsRead", "Warning", "XML setting attribute \"%s\" isn't known.  Ignoring..." % key)
+		
+		
+		FLEET_UNITS = []
+		
+		myvars = xmldoc.getElementsByTagName("Unit")
+		
+		for var in myvars:
+			settings = unitDefaults(UNIT_LD250, "pty")
+			
+			for key in var.attributes.keys():
+				val = str(var.attributes[key].value)
+				
+				if key in settings:
+					settings[key] = val
+					
+				else:
+					log("xmlEMUSettingsRead", "Warning", "XML unit attribute \"%s\" isn't known.  Ignoring..." % key)
+			
+			FLEET_UNITS.append(settings)
+
+def xmlEMUSettingsWrite():
+	if DEBUG_MODE:
+		log("xmlEMUSettingsWrite", "Information", "Starting...")
+	
+	
+	if not os.path.exists(XML_SETTINGS_FILE):
+		xmloutput = file(XML_SETTINGS_FILE, "w")
+		
+		
+		xmldoc = minidom.Document()
+		
+		# Create header
+		settings = xmldoc.createElement("SXRServer")
+		xmldoc.appendChild(settings)
+		
+		# Write each of the details one at a time, makes it easier for someone to alter the file using a text editor
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("ReportInterval", str(FLEET_REPORT_INTERVAL))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("Workers", str(FLEET_WORKERS))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("ClockSpeed", str(FLEET_CLOCK_SPEED))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("RunFor", str(FLEET_RUN_FOR))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("DebugMode", str(DEBUG_MODE))
+		settings.appendChild(var)
+		
+		
+		# One element per emulated unit, with no units yet give them an example of each
+		units = FLEET_UNITS
+		
+		if len(units) == 0:
+			units = [unitDefaults(UNIT_LD250, "pty:ld250-0"), unitDefaults(UNIT_EFM100, "pty:efm100-0")]
+		
+		for unit in units:
+			var = xmldoc.createElement("Unit")
+			
+			for key in ["Type", "Port", "Speed", "Bits", "Parity", "StopBits", "FlushPolicy", "TCPBuffer", "TCPOverflow", "CatchUp", "Rate", "LinePacing", "QueueSize", "QueuePolicy", "StormCells", "Seed", "Latitude", "Longitude"]:
+				var.setAttribute(key, str(unit[key]))
+			
+			settings.appendChild(var)
+		
+		
+		# Finally, save to the file
+		xmloutput.write(xmldoc.toprettyxml())
+		xmloutput.close()
+
+
+########
+# Main #
+########
+if __name__ == "__main__":
+	main()
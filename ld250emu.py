@@ -45,11 +45,13 @@
 ###################################################
 
 
-from Queue import Queue
-
+from collections import deque
 from datetime import *
+from emucommon import *
+import heapq
 import os
-import random
+import select
+import signal
 import sys
 import threading
 import time
@@ -67,12 +69,64 @@ ldunit = None
 #############
 DEBUG_MODE = False
 
+PRIORITY_STATUS = 0
+PRIORITY_SQUELCH = 1
+PRIORITY_STRIKE = 2
+PRIORITY_NOISE = 3
+
+PRIORITY_NAMES = {PRIORITY_STATUS: "status", PRIORITY_SQUELCH: "squelch", PRIORITY_STRIKE: "strike", PRIORITY_NOISE: "noise"}
+PRIORITY_RESERVE = 32
+
+QUEUE_BLOCK = "block"
+QUEUE_COALESCE_NOISE = "coalescenoise"
+QUEUE_DROP_NEWEST = "dropnewest"
+QUEUE_DROP_OLDEST = "dropoldest"
+
+QUEUE_POLICIES = [QUEUE_BLOCK, QUEUE_COALESCE_NOISE, QUEUE_DROP_NEWEST, QUEUE_DROP_OLDEST]
+QUEUE_SIZE = 4096
+QUEUE_URGENT_SIZE = 64
+
+LD250_ARCHIVE_FILES = ""
+LD250_ARCHIVE_SPEED = 1.
+LD250_BEARING_DISTRIBUTION = DISTRIBUTION_UNIFORM
+LD250_BEARING_MEAN = 180.
+LD250_BEARING_SPREAD = 180.
 LD250_BITS = 8
+LD250_CATCHUP = CATCHUP_SKIP
+LD250_CLOCK_SPEED = 1.
+LD250_CLOSE_RANGE = 30
+LD250_DISTANCE_DISTRIBUTION = DISTRIBUTION_UNIFORM
+LD250_DISTANCE_MEAN = 150.
+LD250_DISTANCE_SPREAD = 150.
+LD250_FLASH_BEARING_SCATTER = FLASH_BEARING_SCATTER
+LD250_FLASH_DISTANCE_SCATTER = FLASH_DISTANCE_SCATTER
+LD250_FLASH_INTERVAL_MAX = FLASH_INTERVAL[1]
+LD250_FLASH_INTERVAL_MIN = FLASH_INTERVAL[0]
+LD250_FLASH_STROKES_MAX = FLASH_STROKES[1]
+LD250_FLASH_STROKES_MIN = FLASH_STROKES[0]
+LD250_FLUSH_POLICY = FLUSH_BATCH
+LD250_LINE_PACING = False
 LD250_PARITY = "N"
 LD250_PORT = "/dev/ttyu0"
+LD250_QUEUE_POLICY = QUEUE_BLOCK
+LD250_QUEUE_SIZE = QUEUE_SIZE
+LD250_RECORD_COMPRESS = True
+LD250_RECORD_FILE = ""
+LD250_REPLAY_FILE = ""
+LD250_REPLAY_SPEED = 1.
+LD250_REPLAY_START = 0.
+LD250_RUN_FOR = 0.
+LD250_SEED = 0
+LD250_SEVERE_RANGE = 10
 LD250_SQUELCH = 0
 LD250_SPEED = 9600
+LD250_STATION_LATITUDE = None
+LD250_STATION_LONGITUDE = None
 LD250_STOPBITS = 1
+LD250_STORM_CELLS = 0
+LD250_STORM_SPAWN_INTERVAL = STORM_SPAWN_INTERVAL
+LD250_TCP_BUFFER = TCP_BUFFER
+LD250_TCP_OVERFLOW = TCP_OVERFLOW_DROP
 
 XML_SETTINGS_FILE = "ld250emu-settings.xml"
 
@@ -80,6 +134,75 @@ XML_SETTINGS_FILE = "ld250emu-settings.xml"
 ###########
 # Classes #
 ###########
+class CommandParser():
+	# Incremental framing parser for <start><payload><end> commands.  Data is
+	# consumed in place and the buffer is never scanned twice, anything which
+	# isn't part of a command is dropped and counted in discarded.
+	def __init__(self, start, end, max_buffer = 256):
+		self.buffer = bytearray()
+		self.commands = 0
+		self.discarded = 0
+		self.end = end
+		self.max_buffer = max_buffer
+		self.searched = 0
+		self.start = start
+	
+	def feed(self, data):
+		buffer = self.buffer
+		buffer.extend(data)
+		
+		commands = []
+		pos = 0
+		
+		while True:
+			if self.searched == 0 or buffer[pos:pos + len(self.start)] <> self.start:
+				x = buffer.find(self.start, pos)
+				
+				if x == -1:
+					# Keep a trailing partial start marker, drop the rest
+					keep = len(self.start) - 1
+					
+					while keep > 0 and not self.start.startswith(str(buffer[len(buffer) - keep:])):
+						keep -= 1
+					
+					x = max(pos, len(buffer) - keep)
+					
+					self.discarded += x - pos
+					self.searched = 0
+					pos = x
+					break
+				
+				self.discarded += x - pos
+				self.searched = x + len(self.start)
+				pos = x
+			
+			y = buffer.find(self.end, max(self.searched, pos + len(self.start)))
+			
+			if y == -1:
+				self.searched = len(buffer)
+				break
+			
+			commands.append(str(buffer[pos + len(self.start):y]))
+			
+			self.commands += 1
+			self.searched = 0
+			pos = y + len(self.end)
+		
+		
+		del buffer[:pos]
+		
+		if self.searched > 0:
+			self.searched -= pos
+		
+		if len(buffer) > self.max_buffer:
+			# An unterminated command has grown too big, give up on it
+			self.discarded += len(buffer)
+			self.searched = 0
+			
+			del buffer[:]
+		
+		return commands
+
 class LD250Emu():
 	#
 	# LD sentence key:
@@ -93,13 +216,42 @@ class LD250Emu():
 	# <sa>    = severe alarm status (0 = inactive, 1 = active)
 	# <sss>   = total strike rate 0-999 strikes/minute
 	# <uuu>   = uncorrected strike distance (0-300 miles)
-	def __init__(self, port, speed, bits, parity, stopbits, debug_mode = False):
+	
+	# Precomputed $WIMLI heads and tails, see buildEncoderTables()
+	strike_heads = None
+	strike_tails = None
+	
+	def __init__(self, port, speed, bits, parity, stopbits, debug_mode = False, flush_policy = FLUSH_BATCH, tcp_buffer = TCP_BUFFER, tcp_overflow = TCP_OVERFLOW_DROP, autostart = True, clock = None, catchup = CATCHUP_SKIP, pacing = False, queue_size = QUEUE_SIZE, queue_policy = QUEUE_BLOCK, close_range = 30, severe_range = 10, seed = None):
 		self.alarm_close = False
 		self.alarm_severe = False
+		self.archive = None
+		self.close_range = close_range
+		self.flashes = None
+		self.generator = None
+		self.geo = None
+		self.latency = {}
+		self.lock = threading.Lock()
+		self.clock = clock or RealClock()
+		self.next_status = 0.
+		self.next_storm = None
+		self.output = None
+		self.pacer = None
+		self.rate_close = StrikeCounter()
+		self.rate_severe = StrikeCounter()
+		self.rate_total = StrikeCounter()
+		self.rejected = 0
+		self.replay = None
+		self.rxparser = None
+		self.schedule = None
+		self.seed = newSeed(seed)
 		self.serial = None
+		self.severe_range = severe_range
+		self.storm = None
+		self.stroke_timing = LatencyStats()
+		self.strokes = []
 		self.rxthread = None
 		self.rxthread_alive = False
-		self.txqueue = Queue()
+		self.txqueue = None
 		self.txthread = None
 		self.txthread_alive = False
 		
@@ -110,78 +262,158 @@ class LD250Emu():
 		self.SENTENCE_END = "\r"
 		self.SENTENCE_START = "SQ"
 		
+		self.rxparser = CommandParser(self.SENTENCE_START, self.SENTENCE_END)
+		self.txqueue = TXQueue(queue_size, queue_policy, self.encodeNoise(), self.clock)
+		
+		for priority in [PRIORITY_SQUELCH, PRIORITY_STRIKE, PRIORITY_NOISE]:
+			self.latency[priority] = LatencyStats()
+		
 		
 		# Setup everything we need
 		self.log("__init__", "Information", "Initialising LD-250 emulator...")
+		self.log("__init__", "Information", "The random seed is %d." % self.seed)
+		
+		# Everything random about the unit follows from its seed so a run can be repeated
+		self.flashes = FlashGenerator(seed = self.seed + 1)
+		self.generator = StrikeGenerator(self.seed)
 		
-		self.setupUnit(port, speed, bits, parity, stopbits)
-		self.start()
+		if self.strike_heads is None:
+			self.buildEncoderTables()
+		
+		self.setupUnit(port, speed, bits, parity, stopbits, flush_policy, tcp_buffer, tcp_overflow)
+		
+		if pacing:
+			self.pacer = LinePacer(speed, bits, parity, stopbits)
+			
+			# Sentences handed over to the output share the line
+			self.output.pacer = self.pacer
+		
+		# The status goes out once a second on an absolute grid, see StatusSchedule
+		self.schedule = StatusSchedule(1., self.clock.monotonic() + 1., catchup)
+		self.next_status = self.schedule.deadline()
+		
+		if autostart:
+			self.start()
 	
-	def addNoiseToQueue(self):
-		s = bytearray()
+	def addFlashToQueue(self, distance, bearing, strokes = None):
+		# The strokes are held back until their time comes, see service()
+		with self.lock:
+			flash = self.flashes.flash(distance, bearing, self.clock.monotonic(), strokes)
+			
+			for stroke in flash:
+				heapq.heappush(self.strokes, stroke)
+		
+		self.txqueue.wake()
 		
-		s.extend(self.LD_NOISE)
+		return len(flash)
+	
+	def addGeoStrikesToQueue(self, latitudes, longitudes):
+		# Strikes by location, those out of range of the station aren't sent
+		if self.geo is None:
+			raise ValueError("The station location hasn't been set.")
 		
-		s.extend("*")
+		strikes = self.geo.strikes(latitudes, longitudes)
 		
-		c = self.checksum(str(s))
-		s.extend(c) # <cs>
+		if len(strikes) > 0:
+			self.addStrikesToQueue(strikes)
 		
-		s.extend("\r\n")
+		return strikes
+	
+	def addNoiseToQueue(self):
+		self.txqueue.put(self.encodeNoise(), PRIORITY_NOISE)
+	
+	def addRandomStrikesToQueue(self, count = 1):
+		with self.lock:
+			strikes = self.generator.strikes(count)
 		
+		self.addStrikesToQueue(strikes)
 		
-		self.txqueue.put(str(s))
+		return strikes
 	
 	def addStrikeToQueue(self, distance, bearing):
-		if distance < 0 or distance > 300:
-			distance = 0
-		
-		if bearing < 0. or bearing > 359.9:
-			bearing = 0.
+		return self.addStrikesToQueue([(distance, bearing)]) == 1
+	
+	def addStrikesToQueue(self, strikes, wait = True):
+		# Returns how many were queued, a distance the LD-250 can't give would go out as 0 miles
+		# and count as close and severe so those strikes are left out (and counted) instead
+		valid = [strike for strike in strikes if 0 <= strike[0] <= 300]
 		
+		if len(valid) < len(strikes):
+			with self.lock:
+				self.rejected += len(strikes) - len(valid)
 		
-		s = bytearray()
+		self.txqueue.putMany(self.encodeStrikes(valid), PRIORITY_STRIKE, wait = wait)
 		
-		s.extend(self.LD_STRIKE)
-		s.extend(",")
+		return len(valid)
+	
+	def buildEncoderTables(self):
+		if self.DEBUG_MODE:
+			self.log("buildEncoderTables", "Information", "Running...")
 		
-		s.extend("%d" % distance) # <ddd>
-		s.extend(",")
 		
-		s.extend("%d" % distance) # <uuu>
-		s.extend(",")
+		# The distance appears twice so its contribution to the checksum
+		# cancels itself out, only the constant prefix and the bearing count.
+		# That lets us split each sentence into a head keyed on the distance and
+		# a tail (bearing, checksum and terminator) keyed on the bearing.
+		prefix = self.checksum(self.LD_STRIKE + ",,,")
+		prefix = int(prefix, 16)
 		
-		s.extend("%.1f" % float(bearing)) # <bbb.b>
+		heads = []
 		
-		s.extend("*")
+		for distance in range(0, 301):
+			heads.append("%s,%d,%d" % (self.LD_STRIKE, distance, distance)) # <ddd>,<uuu>
 		
-		c = self.checksum(str(s))
-		s.extend(c) # <cs>
+		tails = []
 		
-		s.extend("\r\n")
+		for tenths in range(0, 3600):
+			b = "%.1f" % (tenths / 10.) # <bbb.b>
+			c = prefix ^ int(self.checksum(b), 16)
+			
+			tails.append(",%s*%02X\r\n" % (b, c)) # <cs>
 		
 		
-		self.txqueue.put(str(s))
+		LD250Emu.strike_heads = heads
+		LD250Emu.strike_tails = tails
 	
 	def checksum(self, data):
+		x = data.find("*")
+		
+		if x <> -1:
+			data = data[:x]
+		
 		s = 0
 		
-		for i in range(len(data)):
-			if data[i] == "$":
-				pass
+		for c in bytearray(data.replace("$", "")):
+			s ^= c
+		
+		return "%02X" % s
+	
+	def countStrikes(self, sentences, now):
+		# Feeds the one-minute rates in the status and the alarms from the strikes actually
+		# written, anything the queue threw away never reached the consumer
+		close = 0
+		severe = 0
+		
+		# The distance is the first field, out of range strikes were never queued
+		start = len(self.LD_STRIKE) + 1
+		
+		for sentence in sentences:
+			distance = int(sentence[start:sentence.index(",", start)])
 			
-			elif data[i] == "*":
-				break
+			if distance <= self.close_range:
+				close += 1
 				
-			else:
-				s = s ^ ord(data[i])
-			
-		checksum = ""
-		
-		s = "%02X" % s
-		checksum += s
+				if distance <= self.severe_range:
+					severe += 1
 		
-		return checksum
+		with self.lock:
+			self.rate_total.add(len(sentences), now)
+			
+			if close > 0:
+				self.rate_close.add(close, now)
+			
+			if severe > 0:
+				self.rate_severe.add(severe, now)
 	
 	def dispose(self):
 		if self.DEBUG_MODE:
@@ -191,106 +423,304 @@ class LD250Emu():
 		self.rxthread_alive = False
 		self.txthread_alive = False
 		
+		self.txqueue.wake()
+		
+		if self.txthread is not None:
+			self.txthread.join(1.)
+		
+		self.txqueue.close()
+		
+		if self.output is not None:
+			self.output.close()
+		
 		if self.serial is not None:
 			self.serial.close()
-			self.serial = None
+		
+		if self.rxthread is not None:
+			self.rxthread.join(1.)
+		
+		self.serial = None
+	
+	def encodeNoise(self):
+		s = self.LD_NOISE + "*"
+		
+		return s + self.checksum(s) + "\r\n"
+	
+	def encodeStatus(self, close_rate, total_rate, alarm_close, alarm_severe, heading = 0.):
+		s = "%s,%d,%d,%d,%d,%05.1f*" % (self.LD_STATUS, close_rate, total_rate, int(alarm_close), int(alarm_severe), heading) # <ccc>,<sss>,<ca>,<sa>,<hhh.h>
+		
+		return s + self.checksum(s) + "\r\n"
+	
+	def encodeStrike(self, distance, bearing):
+		if distance < 0 or distance > 300:
+			distance = 0
+		
+		if bearing < 0. or bearing > 359.9:
+			bearing = 0.
+		
+		
+		return self.strike_heads[int(distance)] + self.strike_tails[int(round(bearing * 10.))]
+	
+	def encodeStrikes(self, strikes):
+		heads = self.strike_heads
+		tails = self.strike_tails
+		
+		sentences = []
+		append = sentences.append
+		
+		for distance, bearing in strikes:
+			if distance < 0 or distance > 300:
+				distance = 0
+			
+			if bearing < 0. or bearing > 359.9:
+				bearing = 0.
+			
+			append(heads[int(distance)] + tails[int(round(bearing * 10.))])
+		
+		return sentences
 	
 	def log(self, module, level, message):
 		print "LD250EMU/%s()/%s - %s" % (module, level, message)
 	
+	def processInput(self, data):
+		parser = self.rxparser
+		
+		discarded = parser.discarded
+		commands = parser.feed(data)
+		
+		if self.DEBUG_MODE and parser.discarded <> discarded:
+			self.log("processInput", "Warning", "%d bytes have been discarded from the serial buffer (%d in total)." % (parser.discarded - discarded, parser.discarded))
+		
+		
+		# Squelch commands have come in, send them all back ahead of anything queued
+		replies = []
+		
+		for command in commands:
+			try:
+				if self.DEBUG_MODE:
+					self.log("processInput", "Information", "Squelch command has come in, sending it back.")
+				
+				
+				squelch = int(command.replace("\n", ""))
+				
+				replies.append(":SQUELCH %d (0-15)\r\n" % squelch)
+				
+			except Exception, ex:
+				if self.DEBUG_MODE:
+					self.log("processInput", "Exception", str(ex))
+		
+		self.txqueue.putMany(replies, PRIORITY_SQUELCH, urgent = True)
+	
 	def rxThread(self):
 		if self.DEBUG_MODE:
 			self.log("rxThread", "Information", "Running...")
 		
 		
-		buffer = bytearray()
-		
 		while self.rxthread_alive:
-			extracted = None
-			
-			
-			bytes = self.serial.inWaiting()
-			
-			if bytes > 0:
-				if self.DEBUG_MODE:
-					self.log("rxThread", "Information", "%d bytes are waiting in the serial buffer." % bytes)
+			# Block until something arrives (or the port timeout expires), then take whatever else is waiting
+			try:
+				data = self.serial.read(1)
 				
+				if len(data) > 0:
+					bytes = self.serial.inWaiting()
+					
+					if bytes > 0:
+						data += self.serial.read(bytes)
 				
-				# Ensure we're thread-safe
-				lock = threading.Lock()
+			except Exception, ex:
+				if not self.rxthread_alive:
+					break
 				
-				with lock:
-					try:
-						buffer.extend(self.serial.read(bytes))
-						
-					except Exception, ex:
-						if self.DEBUG_MODE:
-							self.log("rxThread", "Exception", str(ex))
+				if self.DEBUG_MODE:
+					self.log("rxThread", "Exception", str(ex))
+				
+				time.sleep(0.1)
+				continue
 			
-			x = buffer.find(self.SENTENCE_START)
+			if len(data) == 0:
+				continue
 			
-			if x <> -1:
-				y = buffer.find(self.SENTENCE_END, x)
-				
-				if y <> -1:
-					if self.DEBUG_MODE:
-						self.log("rxThread", "Information", "A sentence has been found in the buffer.")
-					
-					
-					y += len(self.SENTENCE_END)
-					
-					# There appears to be complete sentence in there, extract it
-					extracted = str(buffer[x:y])
-					
 			
+			self.processInput(data)
+	
+	def service(self, now):
+		# Sends the status if it's due plus anything queued, returns when it next needs to be called
+		batch = []
+		
+		if self.storm is not None and now >= self.next_storm:
+			# The transmit side mustn't wait on its own queue, if it's full the strikes go as the policy says
+			strikes = self.storm.step(now)
+			
+			if len(strikes) > 0 and self.replay is None:
+				self.addStrikesToQueue(strikes, False)
+			
+			# Steps stay on a fixed grid so a storm shared with another unit (see FieldModel) keeps in step with it
+			self.next_storm += STORM_STEP
+			
+			if self.next_storm <= now:
+				self.next_storm = now + STORM_STEP
+		
+		strokes = []
+		
+		if len(self.strokes) > 0:
+			# Flash strokes whose time has come
+			with self.lock:
+				while len(self.strokes) > 0 and self.strokes[0][0] <= now:
+					strokes.append(heapq.heappop(self.strokes))
 			
-			if extracted is not None:
-				# Remove it from the buffer first
-				newbuf = str(buffer).replace(extracted, "", 1)
+			if len(strokes) > 0:
+				self.addStrikesToQueue([(distance, bearing) for at, distance, bearing in strokes], False)
+		
+		statuses = self.schedule.due(now)
+		
+		if statuses > 0:
+			# Transmit the status straight away (unless a capture is being replayed), the alarms
+			# can be set by hand as well as by strikes in range over the last minute
+			with self.lock:
+				rate_close = self.rate_close.count(now)
+				rate_total = self.rate_total.count(now)
 				
-				buffer = bytearray()
-				buffer.extend(newbuf)
+				alarm_close = self.alarm_close or rate_close > 0
+				alarm_severe = self.alarm_severe or self.rate_severe.count(now) > 0
+			
+			if self.replay is None:
+				batch.extend([self.encodeStatus(min(rate_close, 999), min(rate_total, 999), alarm_close, alarm_severe)] * statuses)
+			
+			
+			self.next_status = self.schedule.deadline()
+		
+		
+		# Now transmit everything which has been queued since we last woke up in one write, by priority
+		deadline = self.next_status
+		
+		if self.pacer is None:
+			queued = self.txqueue.drain()
+			
+		else:
+			# Only what the line could carry by now, the status always goes but counts against it
+			self.pacer.consume(sum([len(s) for s in batch]), now)
+			
+			limit = self.pacer.available(now)
+			
+			if self.replay is None:
+				# Keep enough of the line back that the next status isn't stuck behind a burst
+				limit = min(limit, self.pacer.before(self.next_status, now) - PRIORITY_RESERVE)
+			
+			# Drained even with no room so the wakeup is cleared, the deadline below brings us back
+			queued = self.txqueue.drain(max(limit, 0))
+			
+			self.pacer.consume(sum([len(e[2]) for e in queued]), now)
+			
+			if not self.txqueue.empty():
+				self.pacer.deferred += 1
 				
+				wake = self.pacer.readyAt()
 				
-				# Squelch command come in, send it back
-				lock = threading.Lock()
+				if wake <= now:
+					# Held back for the status
+					wake = self.next_status
 				
-				with lock:
-					try:
-						if self.DEBUG_MODE:
-							self.log("rxThread", "Information", "Squelch command has come in, sending it back.")
-						
-						
-						squelch = int(extracted.replace("SQ", "").replace("\r", "").replace("\n", ""))
-						
-						self.serial.write(":SQUELCH %d (0-15)\r\n" % squelch)
-						self.serial.flush()
-						
-					except Exception, ex:
-						if self.DEBUG_MODE:
-							self.log("rxThread", "Exception", str(ex))
+				deadline = min(deadline, wake)
+		
+		batch.extend([e[2] for e in queued])
+		
+		self.output.writeBatch(batch)
+		
+		written = self.clock.monotonic()
+		
+		ready = self.output.readyAt()
+		
+		if ready is not None:
+			# Handed over sentences held back for the line
+			deadline = min(deadline, ready)
+		
+		if statuses > 0 and self.replay is None:
+			self.schedule.sent(written, statuses)
+		
+		sent = []
+		
+		for priority, queued_at, sentence in queued:
+			self.latency[priority].add(written - queued_at)
 			
-			time.sleep(0.01)
+			if priority == PRIORITY_STRIKE:
+				sent.append(sentence)
+		
+		if len(sent) > 0:
+			self.countStrikes(sent, written)
+		
+		for stroke in strokes:
+			self.stroke_timing.add(written - stroke[0])
+		
+		if self.storm is not None:
+			deadline = min(deadline, self.next_storm)
+		
+		with self.lock:
+			if len(self.strokes) > 0:
+				deadline = min(deadline, self.strokes[0][0])
+		
+		return deadline
+	
+	def setCloseAlarm(self, active):
+		with self.lock:
+			self.alarm_close = bool(active)
+	
+	def setSevereAlarm(self, active):
+		with self.lock:
+			self.alarm_severe = bool(active)
+	
+	def setStation(self, latitude, longitude):
+		self.geo = GeoProjector(latitude, longitude)
 	
-	def setupUnit(self, port, speed, bits, parity, stopbits):
+	def setStorm(self, storm):
+		# Strikes from a StormModel, None to stop
+		self.next_storm = self.clock.monotonic()
+		self.storm = storm
+		
+		self.txqueue.wake()
+	
+	def setupUnit(self, port, speed, bits, parity, stopbits, flush_policy = FLUSH_BATCH, tcp_buffer = TCP_BUFFER, tcp_overflow = TCP_OVERFLOW_DROP):
 		if self.DEBUG_MODE:
 			self.log("setupUnit", "Information", "Running...")
 		
 		
-		import serial
-		
-		
-		self.serial = serial.Serial()
-		self.serial.baudrate = speed
-		self.serial.bytesize = bits
-		self.serial.parity = parity
-		self.serial.port = port
-		self.serial.stopbits = stopbits
-		self.serial.timeout = 10.
-		self.serial.writeTimeout = None
-		self.serial.xonxoff = False
+		if port == PTY_PREFIX or port.startswith(PTY_PREFIX + ":"):
+			link = port[len(PTY_PREFIX) + 1:]
+			
+			self.serial = PTYPort(iif(link == "", None, link), speed, 10.)
+			self.serial.open()
+			
+			self.log("setupUnit", "Information", "Emulating on pseudo-terminal %s." % iif(link == "", self.serial.name, "%s (%s)" % (link, self.serial.name)))
+			
+		elif port.startswith(FILE_PREFIX + ":"):
+			self.serial = FilePort(port[len(FILE_PREFIX) + 1:], 10.)
+			self.serial.open()
+			
+			self.log("setupUnit", "Information", "Emulating into file %s." % self.serial.name)
+			
+		elif port.startswith(TCP_PREFIX + ":"):
+			self.serial = TCPPort(port[len(TCP_PREFIX) + 1:], tcp_buffer, tcp_overflow, 10.)
+			self.serial.open()
+			
+			self.log("setupUnit", "Information", "Emulating on %s." % self.serial.name)
+			
+		else:
+			import serial
+			
+			
+			self.serial = serial.Serial()
+			self.serial.baudrate = speed
+			self.serial.bytesize = bits
+			self.serial.parity = parity
+			self.serial.port = port
+			self.serial.stopbits = stopbits
+			self.serial.timeout = 10.
+			self.serial.writeTimeout = None
+			self.serial.xonxoff = False
+			
+			self.serial.open()
 		
-		self.serial.open()
+		# Sentences handed over to the output wake the transmit thread through the queue
+		self.output = OutputStage(self.serial, flush_policy, self.clock, self.txqueue)
 	
 	def start(self):
 		if self.DEBUG_MODE:
@@ -311,74 +741,332 @@ class LD250Emu():
 		self.txthread.start()
 	
 	def toggleCloseAlarm(self):
-		self.alarm_close = not self.alarm_close
+		with self.lock:
+			self.alarm_close = not self.alarm_close
+			
+			return self.alarm_close
 	
 	def toggleSevereAlarm(self):
-		self.alarm_severe = not self.alarm_severe
+		with self.lock:
+			self.alarm_severe = not self.alarm_severe
+			
+			return self.alarm_severe
 	
 	def txThread(self):
 		if self.DEBUG_MODE:
 			self.log("txThread", "Information", "Running...")
 		
 		
-		last_status = time.time()
+		deadline = self.next_status
 		
-		while self.txthread_alive:
-			now = time.time()
-			last_status_diff = (now - last_status)
+		self.output.claim()
+		
+		while self.txthread_alive and not self.clock.expired():
+			# Sleep until either a sentence is queued, the status or a flash stroke is due or the
+			# line can take more, a stroke is waited for precisely so the flash keeps its timing
+			with self.lock:
+				spin = iif(len(self.strokes) > 0 and self.strokes[0][0] <= deadline, TIMER_SPIN, 0.)
 			
-			if last_status_diff >= 1.:
-				# Transmit the status straight away
-				s = bytearray()
-				
-				s.extend(self.LD_STATUS)
-				s.extend(",")
-				
-				s.extend("0") # <ccc>
-				s.extend(",")
-				
-				s.extend("0") # <sss>
-				s.extend(",")
-				
-				s.extend("%d" % int(self.alarm_close)) # <ca>
-				s.extend(",")
+			self.clock.waitUntil(self.txqueue, deadline, spin)
+			
+			if not self.txthread_alive:
+				break
+			
+			
+			deadline = self.service(self.clock.monotonic())
+
+class TXLane():
+	# One priority's sentences for TXQueue in the order they were queued,
+	# held in a ring preallocated to the queue's capacity so a lane never
+	# allocates however long the run.  Only used under the queue's lock.
+	def __init__(self, capacity):
+		self.capacity = capacity
+		self.count = 0
+		self.head = 0
+		self.items = [None] * capacity
+	
+	def append(self, entry):
+		self.items[(self.head + self.count) % self.capacity] = entry
+		self.count += 1
+	
+	def find(self, item):
+		# Position (from the head) of the oldest matching sentence
+		for i in xrange(0, self.count):
+			if self.items[(self.head + i) % self.capacity][2] == item:
+				return i
+		
+		return None
+	
+	def first(self):
+		return self.items[self.head]
+	
+	def pop(self):
+		entry = self.items[self.head]
+		
+		self.items[self.head] = None
+		self.head = (self.head + 1) % self.capacity
+		self.count -= 1
+		
+		return entry
+	
+	def remove(self, index):
+		# Closes the gap by moving the older entries up one
+		for i in xrange(index, 0, -1):
+			self.items[(self.head + i) % self.capacity] = self.items[(self.head + i - 1) % self.capacity]
+		
+		self.pop()
+
+class TXQueue():
+	# A bounded queue the transmit thread can sleep on with a deadline.  On
+	# POSIX the wakeup is signalled through a pipe so select() gives us a true
+	# kernel sleep, Queue.get() with a timeout polls every few milliseconds
+	# instead.
+	#
+	# Each sentence is queued with a priority (lower goes first) and the time
+	# it was queued, drain() hands them out highest priority first and in the
+	# order they were queued within a priority.  Urgent sentences (squelch
+	# replies) sit in their own small lane ahead of everything else and never
+	# count against the capacity or block.
+	#
+	# The rest are held in a lane per priority (see TXLane), each a ring
+	# preallocated to capacity so memory stays flat however long the run.
+	# drain() takes from the most important lane with anything in it so it
+	# only costs what it takes, the lanes together hold no more than
+	# capacity.  When they're full the policy decides: -
+	#
+	# block         - The producer waits until there's room (default), the
+	#                 transmit thread itself can't wait so its own strikes
+	#                 are thrown away instead.
+	# dropoldest    - The oldest queued sentence makes way for the new one.
+	# dropnewest    - The new sentence is thrown away.
+	# coalescenoise - A noise sentence is dropped if one is already queued
+	#                 (it carries nothing else), anything else replaces the
+	#                 oldest queued noise sentence, with no noise queued the
+	#                 new sentence is thrown away.
+	def __init__(self, capacity = QUEUE_SIZE, policy = QUEUE_BLOCK, noise = None, clock = None):
+		if policy not in QUEUE_POLICIES:
+			raise ValueError("Queue policy \"%s\" isn't known." % policy)
+		
+		
+		self.capacity = max(1, int(capacity))
+		self.clock = clock or RealClock()
+		self.closed = False
+		self.count = 0
+		self.event = None
+		self.lanes = {}
+		self.lock = threading.Lock()
+		self.noise = noise
+		self.order = []
+		self.pipe_r = None
+		self.pipe_w = None
+		self.policy = policy
+		self.signalled = False
+		self.space = threading.Condition(self.lock)
+		self.urgent = deque(maxlen = QUEUE_URGENT_SIZE)
+		
+		self.blocked = 0
+		self.coalesced = 0
+		self.dropped = 0
+		self.high_water = 0
+		
+		if sys.platform.lower() == "win32":
+			self.event = threading.Event()
+			
+		else:
+			self.pipe_r, self.pipe_w = os.pipe()
+		
+		# Everything the LD-250 queues has its lane from the start
+		for priority in [PRIORITY_SQUELCH, PRIORITY_STRIKE, PRIORITY_NOISE]:
+			self.addLane(priority)
+	
+	def addLane(self, priority):
+		self.lanes[priority] = TXLane(self.capacity)
+		self.order = sorted(self.order + [priority])
+		
+		return self.lanes[priority]
+	
+	def append(self, entry, wait = True):
+		# Called with the lock held, returns False if the entry couldn't be queued
+		if self.count == self.capacity:
+			if self.policy == QUEUE_BLOCK and wait:
+				self.blocked += 1
 				
-				s.extend("%d" % int(self.alarm_severe)) # <sa>
-				s.extend(",")
+				# Make sure the transmit thread is awake to make the room
+				self.signal()
 				
-				s.extend("000.0") # <hhh.h>
+				while self.count == self.capacity and not self.closed:
+					self.space.wait()
 				
-				s.extend("*")
+				if self.closed:
+					return False
 				
-				c = self.checksum(str(s))
-				s.extend(c) # <cs>
+			elif self.policy == QUEUE_DROP_OLDEST:
+				self.lanes[self.oldest()].pop()
+				self.count -= 1
+				self.dropped += 1
 				
-				s.extend("\r\n")
+			elif self.policy == QUEUE_COALESCE_NOISE and self.noise is not None:
+				# Noise only ever goes in its own lane and nothing else does, so its oldest is at the head
+				lane = self.lanes[PRIORITY_NOISE]
+				index = lane.find(self.noise)
 				
+				if entry[2] == self.noise and index is not None:
+					self.coalesced += 1
+					
+					return False
 				
-				lock = threading.Lock()
+				if index is None:
+					self.dropped += 1
+					
+					return False
 				
-				with lock:
-					self.serial.write(str(s))
-					self.serial.flush()
+				lane.remove(index)
+				self.count -= 1
+				self.coalesced += 1
 				
+			else:
+				self.dropped += 1
 				
-				last_status = time.time()
+				return False
+		
+		lane = self.lanes.get(entry[0])
+		
+		if lane is None:
+			# Any other priority gets its lane the first time it's used, and keeps it
+			lane = self.addLane(entry[0])
+		
+		lane.append(entry)
+		
+		self.count += 1
+		self.high_water = max(self.high_water, self.count)
+		
+		return True
+	
+	def close(self):
+		with self.lock:
+			# Let any blocked producers go
+			self.closed = True
+			self.space.notifyAll()
+		
+		if self.pipe_r is not None:
+			os.close(self.pipe_r)
+			os.close(self.pipe_w)
 			
+			self.pipe_r = None
+			self.pipe_w = None
+	
+	def drain(self, limit = None):
+		# Returns (priority, queued at, sentence) for everything queued or, with a
+		# limit, until at least that many bytes have been taken
+		with self.lock:
+			entries = []
+			taken = 0
 			
-			if not self.txqueue.empty():
-				s = self.txqueue.get()
-				
+			while len(self.urgent) > 0 and (limit is None or taken < limit):
+				entries.append(self.urgent.popleft())
+				taken += len(entries[-1][2])
+			
+			if self.count > 0 and (limit is None or taken < limit):
+				for priority in self.order:
+					lane = self.lanes[priority]
+					
+					while lane.count > 0 and (limit is None or taken < limit):
+						entries.append(lane.pop())
+						taken += len(entries[-1][2])
+						
+						self.count -= 1
+					
+					if limit is not None and taken >= limit:
+						break
 				
-				# Now transmit the sentence
-				lock = threading.Lock()
+				self.space.notifyAll()
+			
+			# Whatever is left over is the caller's to reschedule, we don't want waking for it
+			if self.signalled:
+				self.signalled = False
 				
-				with lock:
-					self.serial.write(str(s))
-					self.serial.flush()
+				if self.event is not None:
+					self.event.clear()
+					
+				elif self.pipe_r is not None:
+					os.read(self.pipe_r, 1)
+		
+		return entries
+	
+	def empty(self):
+		return self.count == 0 and len(self.urgent) == 0
+	
+	def fileno(self):
+		return self.pipe_r
+	
+	def oldest(self):
+		# Called with the lock held, the lane whose first sentence was queued first (the least important on a tie)
+		oldest = None
+		
+		for priority in self.order:
+			lane = self.lanes[priority]
+			
+			if lane.count > 0 and (oldest is None or lane.first()[1] <= self.lanes[oldest].first()[1]):
+				oldest = priority
+		
+		return oldest
+	
+	def put(self, item, priority = 0):
+		self.putMany([item], priority)
+	
+	def putMany(self, items, priority = 0, urgent = False, wait = True):
+		if len(items) == 0:
+			return
+		
+		
+		now = self.clock.monotonic()
+		
+		with self.lock:
+			queued = False
+			
+			for item in items:
+				if urgent:
+					self.urgent.append((priority, now, item))
+					
+					queued = True
+					
+				else:
+					queued = self.append((priority, now, item), wait) or queued
 			
+			if queued:
+				self.signal()
+	
+	def qsize(self):
+		return self.count + len(self.urgent)
+	
+	def signal(self):
+		if not self.signalled:
+			self.signalled = True
 			
-			time.sleep(0.01)
+			if self.event is not None:
+				self.event.set()
+				
+			elif self.pipe_w is not None:
+				os.write(self.pipe_w, "\x00")
+	
+	def stats(self):
+		return {"queued": self.count, "capacity": self.capacity, "high_water": self.high_water, "dropped": self.dropped, "coalesced": self.coalesced, "blocked": self.blocked}
+	
+	def wait(self, timeout):
+		if self.signalled:
+			return True
+		
+		if self.event is not None:
+			return self.event.wait(timeout)
+		
+		
+		r, w, x = select.select([self.pipe_r], [], [], timeout)
+		
+		return len(r) > 0
+	
+	def wake(self):
+		with self.lock:
+			self.signal()
 
 
 
@@ -550,11 +1238,53 @@ def main():
 	
 	log("main", "Information", "Setting up...")
 	
-	ldunit = LD250Emu(LD250_PORT, LD250_SPEED, LD250_BITS, LD250_PARITY, LD250_STOPBITS, DEBUG_MODE)
+	ldunit = LD250Emu(LD250_PORT, LD250_SPEED, LD250_BITS, LD250_PARITY, LD250_STOPBITS, DEBUG_MODE, LD250_FLUSH_POLICY, LD250_TCP_BUFFER, LD250_TCP_OVERFLOW, clock = newClock(LD250_CLOCK_SPEED, LD250_RUN_FOR), catchup = LD250_CATCHUP, pacing = LD250_LINE_PACING, queue_size = LD250_QUEUE_SIZE, queue_policy = LD250_QUEUE_POLICY, close_range = LD250_CLOSE_RANGE, severe_range = LD250_SEVERE_RANGE, seed = LD250_SEED, autostart = False)
+	
+	ldunit.flashes = FlashGenerator((LD250_FLASH_STROKES_MIN, LD250_FLASH_STROKES_MAX), (LD250_FLASH_INTERVAL_MIN, LD250_FLASH_INTERVAL_MAX), LD250_FLASH_DISTANCE_SCATTER, LD250_FLASH_BEARING_SCATTER, ldunit.seed + 1)
+	
+	if LD250_STATION_LATITUDE is not None and LD250_STATION_LONGITUDE is not None:
+		ldunit.setStation(LD250_STATION_LATITUDE, LD250_STATION_LONGITUDE)
+	
+	ldunit.generator = StrikeGenerator(ldunit.seed, LD250_DISTANCE_DISTRIBUTION, LD250_DISTANCE_MEAN, LD250_DISTANCE_SPREAD, LD250_BEARING_DISTRIBUTION, LD250_BEARING_MEAN, LD250_BEARING_SPREAD)
+	
+	if LD250_RECORD_FILE <> "":
+		log("main", "Information", "Recording everything sent to %s..." % LD250_RECORD_FILE)
+		
+		recorder = SentenceRecorder(LD250_RECORD_FILE, LD250_RECORD_COMPRESS)
+		recorder.start()
+		
+		ldunit.output.recorder = recorder
+	
+	if LD250_REPLAY_FILE <> "":
+		log("main", "Information", "Replaying %s at %sx from %.1f seconds in..." % (LD250_REPLAY_FILE, iif(LD250_REPLAY_SPEED > 0., LD250_REPLAY_SPEED, "max"), LD250_REPLAY_START))
+		
+		CaptureReplay(ldunit, LD250_REPLAY_FILE, LD250_REPLAY_SPEED, LD250_REPLAY_START).start()
+		
+	elif LD250_STORM_CELLS > 0:
+		log("main", "Information", "Simulating up to %d storm cell(s)..." % LD250_STORM_CELLS)
+		
+		ldunit.setStorm(StormModel(LD250_STORM_CELLS, LD250_STORM_SPAWN_INTERVAL, ldunit.seed + 2))
+	
+	if LD250_ARCHIVE_FILES <> "":
+		paths = [path.strip() for path in LD250_ARCHIVE_FILES.split(",")]
+		
+		log("main", "Information", "Ingesting %d archive(s) at %sx..." % (len(paths), iif(LD250_ARCHIVE_SPEED > 0., LD250_ARCHIVE_SPEED, "max")))
+		
+		try:
+			ArchiveIngest(ldunit, paths, LD250_ARCHIVE_SPEED).start()
+			
+		except ValueError, ex:
+			log("main", "Warning", "%s  The archive(s) won't be ingested." % str(ex))
+	
+	# Only once it's all in place, so with the same seed a run is the same every time
+	ldunit.start()
 	
 	
 	log("main", "Information", "Starting...")
 	
+	if not sys.stdin.isatty():
+		runHeadless()
+	
 	while True:
 		try:
 			print """
@@ -562,6 +1292,7 @@ def main():
 Help
 ====
 s - Generate a random strike
+f - Generate a random flash
 d - Generate noise
 z - Toggle close alarm
 x - Toggle severe alarm
@@ -574,15 +1305,16 @@ Choice:""",
 			if len(i) == 1:
 				if i == "s":
 					# Random strike
-					random.seed(datetime.now())
+					distance, bearing = ldunit.addRandomStrikesToQueue()[0]
 					
-					distance = random.randint(0, 300)
-					bearing = float(random.randint(0, 359))
+					print "Random strike at %d miles %.1f degrees" % (distance, bearing)
 					
+				elif i == "f":
+					# Random multi-stroke flash
+					with ldunit.lock:
+						distance, bearing = ldunit.generator.strikes()[0]
 					
-					ldunit.addStrikeToQueue(distance, bearing)
-					
-					print "Random strike"
+					print "Random flash of %d stroke(s)" % ldunit.addFlashToQueue(distance, bearing)
 					
 				elif i == "d":
 					ldunit.addNoiseToQueue()
@@ -590,14 +1322,10 @@ Choice:""",
 					print "Noise"
 				
 				elif i == "z":
-					ldunit.toggleCloseAlarm()
-					
-					print "Close alarm is now %s" % iif(ldunit.alarm_close, "active", "inactive")
+					print "Close alarm is now %s" % iif(ldunit.toggleCloseAlarm(), "active", "inactive")
 					
 				elif i == "x":
-					ldunit.toggleSevereAlarm()
-					
-					print "Severe alarm is now %s" % iif(ldunit.alarm_severe, "active", "inactive")
+					print "Severe alarm is now %s" % iif(ldunit.toggleSevereAlarm(), "active", "inactive")
 					
 				elif i == "q":
 					print "Quit"
@@ -614,12 +1342,229 @@ Choice:""",
 	log("main", "Information", "Exiting...")
 	exitProgram()
 
+def parseSwitch(value, toggle):
+	value = value.lower()
+	
+	if value == "toggle":
+		return toggle()
+		
+	elif value in ["on", "1", "true"]:
+		return True
+		
+	elif value in ["off", "0", "false"]:
+		return False
+		
+	else:
+		raise ValueError("\"%s\" should be on, off or toggle." % value)
+
+def runCommand(line):
+	#
+	# Headless commands, one per line: -
+	#
+	# strike <distance> <bearing> [<distance> <bearing> ...]
+	# geo <latitude> <longitude> [<latitude> <longitude> ...]
+	# random [<count>]
+	# flash <distance> <bearing> [<strokes>]
+	# noise [<count>]
+	# closealarm on|off|toggle
+	# severealarm on|off|toggle
+	# status
+	# ingest
+	# storm
+	# jitter
+	# line
+	# latency
+	# output
+	# quit
+	#
+	args = line.split()
+	
+	if len(args) == 0 or args[0].startswith("#"):
+		return None
+	
+	command = args[0].lower()
+	
+	if command == "strike":
+		if len(args) < 3 or len(args) % 2 == 0:
+			raise ValueError("strike needs one or more <distance> <bearing> pairs.")
+		
+		strikes = []
+		
+		for i in range(1, len(args), 2):
+			strikes.append((int(args[i]), float(args[i + 1])))
+		
+		queued = ldunit.addStrikesToQueue(strikes)
+		
+		return "%d strike(s)%s" % (queued, iif(queued < len(strikes), ", %d out of range (0-300 miles) left out" % (len(strikes) - queued), ""))
+		
+	elif command == "geo":
+		if len(args) < 3 or len(args) % 2 == 0:
+			raise ValueError("geo needs one or more <latitude> <longitude> pairs.")
+		
+		latitudes = [float(v) for v in args[1::2]]
+		longitudes = [float(v) for v in args[2::2]]
+		
+		strikes = ldunit.addGeoStrikesToQueue(latitudes, longitudes)
+		
+		return "%d of %d strike(s) in range%s" % (len(strikes), len(latitudes), "".join([" %dmi %.1fdeg" % s for s in strikes]))
+		
+	elif command == "random":
+		count = 1
+		
+		if len(args) > 1:
+			count = int(args[1])
+		
+		return "%d random strike(s)" % len(ldunit.addRandomStrikesToQueue(count))
+		
+	elif command == "flash":
+		if len(args) not in [3, 4]:
+			raise ValueError("flash needs <distance> <bearing> and optionally the number of strokes.")
+		
+		strokes = None
+		
+		if len(args) == 4:
+			strokes = int(args[3])
+			
+			if strokes < 1:
+				raise ValueError("A flash needs at least one stroke.")
+		
+		return "Flash of %d stroke(s)" % ldunit.addFlashToQueue(int(args[1]), float(args[2]), strokes)
+		
+	elif command == "noise":
+		count = 1
+		
+		if len(args) > 1:
+			count = int(args[1])
+		
+		ldunit.txqueue.putMany([ldunit.encodeNoise()] * count, PRIORITY_NOISE)
+		
+		return "%d noise" % count
+		
+	elif command == "closealarm" and len(args) == 2:
+		active = parseSwitch(args[1], ldunit.toggleCloseAlarm)
+		ldunit.setCloseAlarm(active)
+		
+		return "Close alarm is now %s" % iif(active, "active", "inactive")
+		
+	elif command == "severealarm" and len(args) == 2:
+		active = parseSwitch(args[1], ldunit.toggleSevereAlarm)
+		ldunit.setSevereAlarm(active)
+		
+		return "Severe alarm is now %s" % iif(active, "active", "inactive")
+		
+	elif command == "status":
+		stats = ldunit.txqueue.stats()
+		
+		with ldunit.lock:
+			now = ldunit.clock.monotonic()
+			
+			rate_close = ldunit.rate_close.count(now)
+			rate_total = ldunit.rate_total.count(now)
+		
+		return "Close alarm %s, severe alarm %s, %d close and %d total strike(s) in the last minute, %d out of range strike(s) left out, %d of %d sentence(s) queued (high water %d, %d dropped, %d coalesced, producer blocked %d time(s))" % (iif(ldunit.alarm_close, "active", "inactive"), iif(ldunit.alarm_severe, "active", "inactive"), rate_close, rate_total, ldunit.rejected, stats["queued"], stats["capacity"], stats["high_water"], stats["dropped"], stats["coalesced"], stats["blocked"])
+		
+	elif command == "ingest":
+		archive = ldunit.archive
+		
+		if archive is None:
+			return "No archive is being ingested"
+		
+		return "Ingest %s" % formatIngest(archive.stats())
+		
+	elif command == "storm":
+		storm = ldunit.storm
+		
+		if storm is None:
+			return "Storm simulation is off"
+		
+		cells = []
+		
+		for cell in sorted(storm.active(), key = lambda cell: cell.distance()):
+			cells.append("%.0fmi %.0fdeg %.0f/min %s" % (cell.distance(), cell.bearing(), cell.rate(), cell.stage()))
+		
+		return "Storm %d cell(s) %.0f strike(s)/min%s" % (len(cells), storm.rate(), iif(len(cells) > 0, ": " + ", ".join(cells), ""))
+		
+	elif command == "jitter":
+		return "Status %s" % formatJitter(ldunit.schedule.stats())
+		
+	elif command == "latency":
+		latencies = ["%s %.3fms mean %.3fms max" % (PRIORITY_NAMES[PRIORITY_STATUS], ldunit.schedule.stats()["late_mean"], ldunit.schedule.stats()["late_max"])]
+		
+		for priority in sorted(ldunit.latency.keys()):
+			stats = ldunit.latency[priority].stats()
+			
+			latencies.append("%s %.3fms mean %.3fms max (%d)" % (PRIORITY_NAMES[priority], stats["mean"], stats["max"], stats["count"]))
+		
+		# How far flash strokes went out from their modelled times
+		stats = ldunit.stroke_timing.stats()
+		
+		latencies.append("flash stroke %.3fms mean %.3fms max (%d)" % (stats["mean"], stats["max"], stats["count"]))
+		
+		return "Latency %s" % ", ".join(latencies)
+		
+	elif command == "line":
+		if ldunit.pacer is None:
+			return "Line pacing is off"
+		
+		return "Line %s" % formatLine(ldunit.pacer.stats(ldunit.clock.monotonic()))
+		
+	elif command == "output":
+		return "Output %s" % formatOutput(ldunit.output.stats())
+		
+	elif command == "quit":
+		exitProgram()
+		
+	else:
+		raise ValueError("\"%s\" isn't a valid command." % line.strip())
+
+def runHeadless():
+	if DEBUG_MODE:
+		log("runHeadless", "Information", "Starting...")
+	
+	
+	# No TTY so take commands from stdin instead of the menu, once stdin is
+	# closed carry on emulating until we're interrupted or terminated
+	def terminate(signum, frame):
+		raise KeyboardInterrupt()
+	
+	signal.signal(signal.SIGTERM, terminate)
+	
+	log("runHeadless", "Information", "No TTY, reading commands from stdin...")
+	
+	try:
+		for line in iter(sys.stdin.readline, ""):
+			try:
+				reply = runCommand(line)
+				
+				if reply is not None:
+					print reply
+					
+					sys.stdout.flush()
+				
+			except ValueError, ex:
+				log("runHeadless", "Warning", str(ex))
+		
+		while True:
+			if ldunit.clock.expired() and not ldunit.txthread.isAlive():
+				log("runHeadless", "Information", "The run has finished.")
+				
+				break
+			
+			time.sleep(iif(isinstance(ldunit.clock, VirtualClock), 0.5, 3600.))
+		
+	except KeyboardInterrupt:
+		pass
+	
+	
+	log("main", "Information", "Exiting...")
+	exitProgram()
+
 def xmlEMUSettingsRead():
 	if DEBUG_MODE:
 		log("xmlEMUSettingsRead", "Information", "Starting...")
 	
 	
-	global DEBUG_MODE, LD250_PARITY, LD250_PORT, LD250_SPEED, LD250_STOPBITS
+	global DEBUG_MODE, LD250_ARCHIVE_FILES, LD250_ARCHIVE_SPEED, LD250_BEARING_DISTRIBUTION, LD250_BEARING_MEAN, LD250_BEARING_SPREAD, LD250_BITS, LD250_CATCHUP, LD250_CLOCK_SPEED, LD250_CLOSE_RANGE, LD250_DISTANCE_DISTRIBUTION, LD250_DISTANCE_MEAN, LD250_DISTANCE_SPREAD, LD250_FLASH_BEARING_SCATTER, LD250_FLASH_DISTANCE_SCATTER, LD250_FLASH_INTERVAL_MAX, LD250_FLASH_INTERVAL_MIN, LD250_FLASH_STROKES_MAX, LD250_FLASH_STROKES_MIN, LD250_FLUSH_POLICY, LD250_LINE_PACING, LD250_PARITY, LD250_PORT, LD250_QUEUE_POLICY, LD250_QUEUE_SIZE, LD250_RECORD_COMPRESS, LD250_RECORD_FILE, LD250_REPLAY_FILE, LD250_REPLAY_SPEED, LD250_REPLAY_START, LD250_RUN_FOR, LD250_SEED, LD250_SEVERE_RANGE, LD250_SPEED, LD250_STATION_LATITUDE, LD250_STATION_LONGITUDE, LD250_STOPBITS, LD250_STORM_CELLS, LD250_STORM_SPAWN_INTERVAL, LD250_TCP_BUFFER, LD250_TCP_OVERFLOW
 	
 	
 	if os.path.exists(XML_SETTINGS_FILE):
@@ -632,21 +1577,128 @@ def xmlEMUSettingsRead():
 				val = str(var.attributes[key].value)
 				
 				# Now put the correct values to correct key
-				if key == "LD250Bits":
+				if key == "LD250ArchiveFiles":
+					LD250_ARCHIVE_FILES = val
+					
+				elif key == "LD250ArchiveSpeed":
+					LD250_ARCHIVE_SPEED = float(val)
+					
+				elif key == "LD250BearingDistribution":
+					LD250_BEARING_DISTRIBUTION = val
+					
+				elif key == "LD250BearingMean":
+					LD250_BEARING_MEAN = float(val)
+					
+				elif key == "LD250BearingSpread":
+					LD250_BEARING_SPREAD = float(val)
+					
+				elif key == "LD250Bits":
 					LD250_BITS = int(val)
 					
+				elif key == "LD250ClockSpeed":
+					LD250_CLOCK_SPEED = float(val)
+					
+				elif key == "LD250CloseRange":
+					LD250_CLOSE_RANGE = int(val)
+					
+				elif key == "LD250DistanceDistribution":
+					LD250_DISTANCE_DISTRIBUTION = val
+					
+				elif key == "LD250DistanceMean":
+					LD250_DISTANCE_MEAN = float(val)
+					
+				elif key == "LD250DistanceSpread":
+					LD250_DISTANCE_SPREAD = float(val)
+					
+				elif key == "LD250FlashBearingScatter":
+					LD250_FLASH_BEARING_SCATTER = float(val)
+					
+				elif key == "LD250FlashDistanceScatter":
+					LD250_FLASH_DISTANCE_SCATTER = float(val)
+					
+				elif key == "LD250FlashIntervalMax":
+					LD250_FLASH_INTERVAL_MAX = float(val)
+					
+				elif key == "LD250FlashIntervalMin":
+					LD250_FLASH_INTERVAL_MIN = float(val)
+					
+				elif key == "LD250FlashStrokesMax":
+					LD250_FLASH_STROKES_MAX = int(val)
+					
+				elif key == "LD250FlashStrokesMin":
+					LD250_FLASH_STROKES_MIN = int(val)
+					
+				elif key == "LD250FlushPolicy":
+					LD250_FLUSH_POLICY = val
+					
+				elif key == "LD250LinePacing":
+					LD250_LINE_PACING = cBool(val)
+					
 				elif key == "LD250Parity":
 					LD250_PARITY = val
 					
 				elif key == "LD250Port":
 					LD250_PORT = val
 					
+				elif key == "LD250QueuePolicy":
+					LD250_QUEUE_POLICY = val
+					
+				elif key == "LD250QueueSize":
+					LD250_QUEUE_SIZE = int(val)
+					
+				elif key == "LD250RecordCompress":
+					LD250_RECORD_COMPRESS = cBool(val)
+					
+				elif key == "LD250RecordFile":
+					LD250_RECORD_FILE = val
+					
+				elif key == "LD250ReplayFile":
+					LD250_REPLAY_FILE = val
+					
+				elif key == "LD250ReplaySpeed":
+					LD250_REPLAY_SPEED = float(val)
+					
+				elif key == "LD250ReplayStart":
+					LD250_REPLAY_START = float(val)
+					
+				elif key == "LD250RunFor":
+					LD250_RUN_FOR = float(val)
+					
+				elif key == "LD250Seed":
+					LD250_SEED = int(val)
+					
+				elif key == "LD250SevereRange":
+					LD250_SEVERE_RANGE = int(val)
+					
 				elif key == "LD250Speed":
 					LD250_SPEED = int(val)
 					
+				elif key == "LD250StationLatitude":
+					if val <> "":
+						LD250_STATION_LATITUDE = float(val)
+					
+				elif key == "LD250StationLongitude":
+					if val <> "":
+						LD250_STATION_LONGITUDE = float(val)
+					
+				elif key == "LD250StatusCatchUp":
+					LD250_CATCHUP = val
+					
 				elif key == "LD250StopBits":
 					LD250_STOPBITS = int(val)
 					
+				elif key == "LD250StormCells":
+					LD250_STORM_CELLS = int(val)
+					
+				elif key == "LD250StormSpawnInterval":
+					LD250_STORM_SPAWN_INTERVAL = float(val)
+					
+				elif key == "LD250TCPBuffer":
+					LD250_TCP_BUFFER = int(val)
+					
+				elif key == "LD250TCPOverflow":
+					LD250_TCP_OVERFLOW = val
+					
 				elif key == "DebugMode":
 					DEBUG_MODE = cBool(val)
 					
@@ -689,6 +1741,147 @@ def xmlEMUSettingsWrite():
 		var.setAttribute("LD250StopBits", str(LD250_STOPBITS))
 		settings.appendChild(var)
 		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250FlushPolicy", str(LD250_FLUSH_POLICY))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250LinePacing", str(LD250_LINE_PACING))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250QueueSize", str(LD250_QUEUE_SIZE))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250QueuePolicy", str(LD250_QUEUE_POLICY))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250TCPBuffer", str(LD250_TCP_BUFFER))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250TCPOverflow", str(LD250_TCP_OVERFLOW))
+		settings.appendChild(var)
+		
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250ClockSpeed", str(LD250_CLOCK_SPEED))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250RunFor", str(LD250_RUN_FOR))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250StatusCatchUp", str(LD250_CATCHUP))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250RecordFile", str(LD250_RECORD_FILE))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250RecordCompress", str(LD250_RECORD_COMPRESS))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250ReplayFile", str(LD250_REPLAY_FILE))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250ReplaySpeed", str(LD250_REPLAY_SPEED))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250ReplayStart", str(LD250_REPLAY_START))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250CloseRange", str(LD250_CLOSE_RANGE))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250SevereRange", str(LD250_SEVERE_RANGE))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250StormCells", str(LD250_STORM_CELLS))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250StormSpawnInterval", str(LD250_STORM_SPAWN_INTERVAL))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250ArchiveFiles", str(LD250_ARCHIVE_FILES))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250ArchiveSpeed", str(LD250_ARCHIVE_SPEED))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250StationLatitude", iif(LD250_STATION_LATITUDE is None, "", str(LD250_STATION_LATITUDE)))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250StationLongitude", iif(LD250_STATION_LONGITUDE is None, "", str(LD250_STATION_LONGITUDE)))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250Seed", str(LD250_SEED))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250DistanceDistribution", str(LD250_DISTANCE_DISTRIBUTION))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250DistanceMean", str(LD250_DISTANCE_MEAN))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250DistanceSpread", str(LD250_DISTANCE_SPREAD))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250BearingDistribution", str(LD250_BEARING_DISTRIBUTION))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250BearingMean", str(LD250_BEARING_MEAN))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250BearingSpread", str(LD250_BEARING_SPREAD))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250FlashStrokesMin", str(LD250_FLASH_STROKES_MIN))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250FlashStrokesMax", str(LD250_FLASH_STROKES_MAX))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250FlashIntervalMin", str(LD250_FLASH_INTERVAL_MIN))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250FlashIntervalMax", str(LD250_FLASH_INTERVAL_MAX))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250FlashDistanceScatter", str(LD250_FLASH_DISTANCE_SCATTER))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("LD250FlashBearingScatter", str(LD250_FLASH_BEARING_SCATTER))
+		settings.appendChild(var)
+		
 		
 		var = xmldoc.createElement("Setting")
 		var.setAttribute("DebugMode", str(DEBUG_MODE))
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#########################################################################
+# Copyright/License Notice (BSD License)                                #
+#########################################################################
+#########################################################################
+# Copyright (c) 2011, Daniel Knaggs                                     #
+# All rights reserved.                                                  #
+#                                                                       #
+# Redistribution and use in source and binary forms, with or without    #
+# modification, are permitted provided that the following conditions    #
+# are met: -                                                            #
+#                                                                       #
+#   * Redistributions of source code must retain the above copyright    #
+#     notice, this list of conditions and the following disclaimer.     #
+#                                                                       #
+#   * Redistributions in binary form must reproduce the above copyright #
+#     notice, this list of conditions and the following disclaimer in   #
+#     the documentation and/or other materials provided with the        #
+#     distribution.                                                     #
+#                                                                       #
+#   * Neither the name of the author nor the names of its contributors  #
+#     may be used to endorse or promote products derived from this      #
+#     software without specific prior written permission.               #
+#                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS   #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT     #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR #
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT  #
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, #
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT      #
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, #
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY #
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT   #
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  #
+#########################################################################
+
+
+
+###################################################
+# Boltek Emulator Storm Scenario                  #
+###################################################
+# Version:     v0.1.2                             #
+###################################################
+
+
+from datetime import *
+from emucommon import *
+from fleetemu import FleetHost, UNIT_EFM100, UNIT_LD250, formatStats, newUnit, unitDefaults
+import os
+import sys
+from xml.dom import minidom
+
+
+###########
+# Globals #
+###########
+scenario = None
+
+
+#############
+# Constants #
+#############
+DEBUG_MODE = False
+
+SCENARIO_CLOCK_SPEED = 1.
+SCENARIO_REPORT_INTERVAL = 10.
+SCENARIO_RUN_FOR = 0.
+SCENARIO_STORM_CELLS = 8
+SCENARIO_UNITS = []
+
+XML_SETTINGS_FILE = "stormemu-settings.xml"
+
+
+###########
+# Classes #
+###########
+class StormScenario():
+	# An LD-250 and an EFM-100 driven by the same storm.  The LD-250 steps
+	# the StormModel and sends its strikes, a FieldModel on the same storm
+	# sets the EFM-100's field from the cells and the strikes close by.  Both
+	# units run in one FleetHost on one clock, so a strike and the field
+	# excursion it causes go out within a service of each other however
+	# fast the clock runs.
+	def __init__(self, ld_settings, efm_settings, clock, debug_mode = False):
+		self.field = None
+		self.host = FleetHost(debug_mode, clock)
+		self.last_report = None
+		
+		self.DEBUG_MODE = debug_mode
+		
+		
+		# The LD-250 goes in first so it steps the storm before the EFM-100 samples the field at the same time
+		self.ld = newUnit(ld_settings, clock, debug_mode)
+		self.efm = newUnit(efm_settings, clock, debug_mode)
+		
+		if self.ld.storm is None:
+			self.ld.setStorm(StormModel(SCENARIO_STORM_CELLS, seed = self.ld.seed + 2))
+		
+		self.field = FieldModel(self.ld.storm)
+		self.efm.setFieldModel(self.field)
+		
+		self.host.addUnit(self.ld)
+		self.host.addUnit(self.efm)
+		
+		self.host.report_callback = self.report
+	
+	def dispose(self):
+		if self.DEBUG_MODE:
+			self.log("dispose", "Information", "Running...")
+		
+		
+		self.host.dispose()
+	
+	def log(self, module, level, message):
+		print "STORMEMU/%s()/%s - %s" % (module, level, message)
+	
+	def report(self, stats):
+		if self.last_report is not None:
+			self.log("report", "Information", formatStats(stats, self.last_report))
+		
+		
+		now = self.host.clock.monotonic()
+		cells = self.ld.storm.active()
+		nearest = ""
+		
+		if len(cells) > 0:
+			nearest = ", nearest %.0fmi" % min([cell.distance() for cell in cells])
+		
+		with self.ld.lock:
+			rate_close = self.ld.rate_close.count(now)
+			rate_total = self.ld.rate_total.count(now)
+		
+		self.log("report", "Information", "Storm %d cell(s)%s, %d close and %d total strike(s) in the last minute, field %.2fKV." % (len(cells), nearest, rate_close, rate_total, self.field.level(now)))
+		
+		self.last_report = stats
+	
+	def run(self, report_interval = None):
+		self.host.run(report_interval)
+	
+	def stop(self):
+		self.host.stop()
+
+
+
+###############
+# Subroutines #
+###############
+def cBool(value):
+	if DEBUG_MODE:
+		log("cBool", "Information", "Starting...")
+	
+	
+	if str(value).lower() == "false" or str(value) == "0":
+		return False
+		
+	elif str(value).lower() == "true" or str(value) == "1":
+		return True
+		
+	else:
+		return False
+
+def exitProgram():
+	if DEBUG_MODE:
+		log("exitProgram", "Information", "Starting...")
+	
+	
+	global scenario
+	
+	
+	if scenario is not None:
+		scenario.dispose()
+		scenario = None
+	
+	
+	sys.exit(0)
+
+def log(module, level, message):
+	t = datetime.now()
+	
+	print "%s | EMU/%s()/%s - %s" % (str(t.strftime("%d/%m/%Y %H:%M:%S")), module, level, message)
+
+def main():
+	if DEBUG_MODE:
+		log("main", "Information", "Starting...")
+	
+	
+	global scenario
+	
+	
+	print """
+#########################################################################
+# Copyright/License Notice (BSD License)                                #
+#########################################################################
+#########################################################################
+# Copyright (c) 2011, Daniel Knaggs                                     #
+# All rights reserved.                                                  #
+#                                                                       #
+# Redistribution and use in source and binary forms, with or without    #
+# modification, are permitted provided that the following conditions    #
+# are met: -                                                            #
+#                                                                       #
+#   * Redistributions of source code must retain the above copyright    #
+#     notice, this list of conditions and the following disclaimer.     #
+#                                                                       #
+#   * Redistributions in binary form must reproduce the above copyright #
+#     notice, this list of conditions and the following disclaimer in   #
+#     the documentation and/or other materials provided with the        #
+#     distribution.                                                     #
+#                                                                       #
+#   * Neither the name of the author nor the names of its contributors  #
+#     may be used to endorse or promote products derived from this      #
+#     software without specific prior written permission.               #
+#                                                                       #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS   #
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT     #
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR #
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT  #
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, #
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT      #
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, #
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY #
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT   #
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE #
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.  #
+#########################################################################
+"""
+	log("main", "Information", "")
+	log("main", "Information", "Boltek Emulator Storm Scenario")
+	log("main", "Information", "==============================")
+	log("main", "Information", "Checking settings...")
+	
+	
+	if not os.path.exists(XML_SETTINGS_FILE):
+		log("main", "Warning", "The XML settings file doesn't exist, create one...")
+		
+		xmlEMUSettingsWrite()
+		
+		
+		log("main", "Information", "The XML settings file has been created using the default settings.  Please edit it and restart the emulator once you're happy with the settings.")
+		
+		exitProgram()
+		
+	else:
+		log("main", "Information", "Reading XML settings...")
+		
+		xmlEMUSettingsRead()
+		
+		# This will ensure it will have any new settings in
+		if os.path.exists(XML_SETTINGS_FILE + ".bak"):
+			os.unlink(XML_SETTINGS_FILE + ".bak")
+			
+		os.rename(XML_SETTINGS_FILE, XML_SETTINGS_FILE + ".bak")
+		xmlEMUSettingsWrite()
+	
+	
+	
+	ld_settings = [unit for unit in SCENARIO_UNITS if unit["Type"] == UNIT_LD250]
+	efm_settings = [unit for unit in SCENARIO_UNITS if unit["Type"] == UNIT_EFM100]
+	
+	if len(ld_settings) <> 1 or len(efm_settings) <> 1:
+		log("main", "Error", "The scenario needs exactly one LD-250 and one EFM-100 unit.")
+		
+		exitProgram()
+	
+	
+	log("main", "Information", "Setting up...")
+	
+	scenario = StormScenario(ld_settings[0], efm_settings[0], newClock(SCENARIO_CLOCK_SPEED, SCENARIO_RUN_FOR), DEBUG_MODE)
+	
+	
+	log("main", "Information", "Starting, press CTRL+C to quit...")
+	
+	try:
+		scenario.run(SCENARIO_REPORT_INTERVAL)
+		
+	except KeyboardInterrupt:
+		pass
+	
+	
+	log("main", "Information", "Exiting...")
+	exitProgram()
+
+def scenarioDefaults(unit_type, port):
+	# As a fleet unit, but the LD-250 has a storm to drive
+	settings = unitDefaults(unit_type, port)
+	
+	if unit_type == UNIT_LD250:
+		settings["StormCells"] = str(SCENARIO_STORM_CELLS)
+	
+	return settings
+
+def xmlEMUSettingsRead():
+	global DEBUG_MODE, SCENARIO_CLOCK_SPEED, SCENARIO_REPORT_INTERVAL, SCENARIO_RUN_FOR, SCENARIO_UNITS
+	
+	
+	if DEBUG_MODE:
+		log("xmlEMUSettingsRead", "Information", "Starting...")
+	
+	
+	if os.path.exists(XML_SETTINGS_FILE):
+		xmldoc = minidom.parse(XML_SETTINGS_FILE)
+		
+		myvars = xmldoc.getElementsByTagName("Setting")
+		
+		for var in myvars:
+			for key in var.attributes.keys():
+				val = str(var.attributes[key].value)
+				
+				# Now put the correct values to correct key
+				if key == "ReportInterval":
+					SCENARIO_REPORT_INTERVAL = float(val)
+					
+				elif key == "ClockSpeed":
+					SCENARIO_CLOCK_SPEED = float(val)
+					
+				elif key == "RunFor":
+					SCENARIO_RUN_FOR = float(val)
+					
+				elif key == "DebugMode":
+					DEBUG_MODE = cBool(val)
+					
+				else:
+					log("xmlEMUSettingsRead", "Warning", "XML setting attribute \"%s\" isn't known.  Ignoring..." % key)
+		
+		
+		SCENARIO_UNITS = []
+		
+		myvars = xmldoc.getElementsByTagName("Unit")
+		
+		for var in myvars:
+			unit_type = UNIT_LD250
+			
+			if var.hasAttribute("Type"):
+				unit_type = str(var.attributes["Type"].value)
+			
+			settings = scenarioDefaults(unit_type, "pty")
+			
+			for key in var.attributes.keys():
+				val = str(var.attributes[key].value)
+				
+				if key in settings:
+					settings[key] = val
+					
+				else:
+					log("xmlEMUSettingsRead", "Warning", "XML unit attribute \"%s\" isn't known.  Ignoring..." % key)
+			
+			SCENARIO_UNITS.append(settings)
+
+def xmlEMUSettingsWrite():
+	if DEBUG_MODE:
+		log("xmlEMUSettingsWrite", "Information", "Starting...")
+	
+	
+	if not os.path.exists(XML_SETTINGS_FILE):
+		xmloutput = file(XML_SETTINGS_FILE, "w")
+		
+		
+		xmldoc = minidom.Document()
+		
+		# Create header
+		settings = xmldoc.createElement("SXRServer")
+		xmldoc.appendChild(settings)
+		
+		# Write each of the details one at a time, makes it easier for someone to alter the file using a text editor
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("ReportInterval", str(SCENARIO_REPORT_INTERVAL))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("ClockSpeed", str(SCENARIO_CLOCK_SPEED))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("RunFor", str(SCENARIO_RUN_FOR))
+		settings.appendChild(var)
+		
+		var = xmldoc.createElement("Setting")
+		var.setAttribute("DebugMode", str(DEBUG_MODE))
+		settings.appendChild(var)
+		
+		
+		# The two units, with none yet give them a pair on pseudo-terminals
+		units = SCENARIO_UNITS
+		
+		if len(units) == 0:
+			units = [scenarioDefaults(UNIT_LD250, "pty:ld250-0"), scenarioDefaults(UNIT_EFM100, "pty:efm100-0")]
+		
+		for unit in units:
+			var = xmldoc.createElement("Unit")
+			
+			for key in ["Type", "Port", "Speed", "Bits", "Parity", "StopBits", "FlushPolicy", "TCPBuffer", "TCPOverflow", "CatchUp", "Rate", "LinePacing", "QueueSize", "QueuePolicy", "StormCells", "Seed", "Latitude", "Longitude"]:
+				var.setAttribute(key, str(unit[key]))
+			
+			settings.appendChild(var)
+		
+		
+		# Finally, save to the file
+		xmloutput.write(xmldoc.toprettyxml())
+		xmloutput.close()
+
+
+########
+# Main #
+########
+if __name__ == "__main__":
+	main()